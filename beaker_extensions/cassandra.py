@@ -1,9 +1,9 @@
 import logging
+import math
 from beaker.exceptions import InvalidCacheBackendError, MissingCacheParameter
 
 from beaker_extensions.nosql import Container
 from beaker_extensions.nosql import NoSqlManager
-from beaker_extensions.nosql import pickle
 
 try:
     import pycassa
@@ -18,57 +18,171 @@ class CassandraManager(NoSqlManager):
 
     Configuration example:
         beaker.session.type = cassandra
-        beaker.session.url = localhost:9160
+        beaker.session.url = cass1:9160,cass2:9160
         beaker.session.keyspace = Keyspace1
         beaker.session.column_family = beaker
 
+    The url lists the servers to connect to, separated by commas.
+    read_consistency and write_consistency take consistency level names
+    (e.g. ONE for caches, QUORUM for sessions); values expire through
+    Cassandra TTLs.
     The default column_family is 'beaker'.
     If it doesn't exist under given keyspace, it is created automatically.
+    Connection pools and column families are shared by every manager
+    using the same keyspace and servers.
     """
+
+    connection_pools = {}
+    column_families = {}
+
     def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, keyspace=None, column_family=None, **params):
         if not keyspace:
             raise MissingCacheParameter("keyspace is required")
         self.keyspace = keyspace
         self.column_family = column_family or 'beaker'
+        self.page_size = int(params.pop('page_size', 1024))
+        self.remove_batch_size = int(params.pop('remove_batch_size', 100))
+        self.read_consistency = self._consistency_level(params.pop('read_consistency', None))
+        self.write_consistency = self._consistency_level(params.pop('write_consistency', None))
         NoSqlManager.__init__(self, namespace, url=url, data_dir=data_dir, lock_dir=lock_dir, **params)
 
-    def open_connection(self, host, port, **params):
-        self.pool = pycassa.ConnectionPool(self.keyspace)
+    def _consistency_level(self, name):
+        if not name:
+            return None
+        try:
+            return getattr(pycassa.ConsistencyLevel, name.upper())
+        except AttributeError:
+            raise InvalidCacheBackendError("Unknown Cassandra consistency level: %s" % name)
+
+    def _ttl(self, value, expiretime=None):
+        expiretime = self._item_expiretime(value, expiretime)
+        return int(math.ceil(expiretime)) if expiretime else None
+
+    def _local_cache_key(self, url, conn_params):
+        return NoSqlManager._local_cache_key(self, url, conn_params) + (
+            self.keyspace, self.column_family)
+
+    def open_url(self, url, **params):
+        servers = [server.strip() for server in url.split(',')]
+        pool_key = (self.keyspace, tuple(servers))
+        if pool_key not in self.connection_pools:
+            self.connection_pools.setdefault(
+                pool_key, pycassa.ConnectionPool(self.keyspace, server_list=servers, **params))
+        self.pool = self.connection_pools[pool_key]
+
+        cf_key = pool_key + (self.column_family,)
+        if cf_key not in self.column_families:
+            try:
+                cf = pycassa.ColumnFamily(self.pool, self.column_family)
+            except pycassa.NotFoundException:
+                log.info("Creating new %s ColumnFamily." % self.column_family)
+                system_manager = pycassa.system_manager.SystemManager(servers[0])
+                system_manager.create_column_family(self.keyspace, self.column_family)
+                cf = pycassa.ColumnFamily(self.pool, self.column_family)
+            self.column_families.setdefault(cf_key, cf)
+        self.cf = self.column_families[cf_key]
+
+    def _acquire_lock(self, key, token, timeout):
+        # No compare-and-set here: every contender adds its token as a column
+        # of the lock row and the earliest token wins.
+        self.cf.insert(key, {token: ''}, ttl=int(math.ceil(timeout)),
+                       write_consistency_level=self.write_consistency)
         try:
-            self.cf = pycassa.ColumnFamily(self.pool, self.column_family)
+            holder = next(iter(self.cf.get(key, column_count=1,
+                                           read_consistency_level=self.read_consistency)))
         except pycassa.NotFoundException:
-            log.info("Creating new %s ColumnFamily." % self.column_family)
-            system_manager = pycassa.system_manager.SystemManager()
-            system_manager.create_column_family(self.keyspace, self.column_family)
-            self.cf = pycassa.ColumnFamily(self.pool, self.column_family)
+            holder = None
+        if holder == token:
+            return True
+        self._release_lock(key, token)
+        return False
 
-    def __contains__(self, key):        
-        return self.cf.get_count(self._format_key(key)) > 0
+    def _release_lock(self, key, token):
+        self.cf.remove(key, columns=[token],
+                       write_consistency_level=self.write_consistency)
+
+    def __contains__(self, key):
+        try:
+            self.cf.get(self._format_key(key), columns=['data'],
+                        read_consistency_level=self.read_consistency)
+        except pycassa.NotFoundException:
+            return False
+        return True
 
     def set_value(self, key, value, expiretime=None):
         key = self._format_key(key)
-        self.cf.insert(key, {'data': pickle.dumps(value, 2)}, ttl=expiretime)
+        self.cf.insert(key, {'data': self._dumps(value)},
+                       ttl=self._ttl(value, expiretime),
+                       write_consistency_level=self.write_consistency)
 
     def __getitem__(self, key):
         try:
-            result = self.cf.get(self._format_key(key))
-            return pickle.loads(result['data'])
+            result = self.cf.get(self._format_key(key), columns=['data'],
+                                 read_consistency_level=self.read_consistency)
+            return self._loads(result['data'])
         except pycassa.NotFoundException:
             return None
 
-    def __delitem__(self, key):        
-        key = self._format_key(key)
-        self.cf.remove(self._format_key(key))
+    def __delitem__(self, key):
+        self.cf.remove(self._format_key(key),
+                       write_consistency_level=self.write_consistency)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        rows = self.cf.multiget([self._format_key(key) for key in keys],
+                                columns=['data'],
+                                read_consistency_level=self.read_consistency)
+        result = {}
+        for key in keys:
+            row = rows.get(self._format_key(key))
+            if row and 'data' in row:
+                result[key] = self._loads(row['data'])
+        return result
+
+    def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        batch = self.cf.batch(write_consistency_level=self.write_consistency)
+        for key, value in items:
+            batch.insert(self._format_key(key), {'data': self._dumps(value)},
+                         ttl=self._ttl(value, expiretime))
+        batch.send()
+
+    def delete_many(self, keys):
+        batch = self.cf.batch(write_consistency_level=self.write_consistency)
+        for key in keys:
+            batch.remove(self._format_key(key))
+        batch.send()
 
     def _format_key(self, key):
         return '%s:%s' % (self.namespace, key.replace(' ', '\302\267'))
 
     def do_remove(self):
-        for key, empty in cf.get_range(column_count=0, filter_empty=False):
-            cf.remove(key)
+        # The mutator sends its queued removals every remove_batch_size rows.
+        batch = self.cf.batch(queue_size=self.remove_batch_size,
+                              write_consistency_level=self.write_consistency)
+        for key in self.iterkeys():
+            batch.remove(key)
+        batch.send()
+
+    def iterkeys(self):
+        """Iterate over the row keys of this namespace.
+
+        Row keys are not ordered under the usual partitioners, so this pages
+        through the whole column family, page_size rows at a time, keeping
+        only the rows of this namespace. Rows deleted but not compacted yet
+        are skipped.
+        """
+        prefix = self._format_key('')
+        for key, columns in self.cf.get_range(column_count=1, buffer_size=self.page_size,
+                                              read_consistency_level=self.read_consistency):
+            if key.startswith(prefix):
+                yield key
 
     def keys(self):
-        return list(key for key, empty in self.cf.get_range(column_count=0, filter_empty=False))
+        return list(self.iterkeys())
 
 
 class CassandraContainer(Container):
@@ -37,8 +37,8 @@ class DynomiteManager(NoSqlManager):
     def has_key(self, key):
         return key in self
 
-    def set_value(self, key, value):
-        self.db_conn.put(self._format_key(key), None, value)
+    def set_value(self, key, value, expiretime=None):
+        self.db_conn.put(self._format_key(key), None, self._dumps(value))
 
     def __delitem__(self, key):
         self.db_conn.remove(self._format_key(key))
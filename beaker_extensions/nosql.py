@@ -1,19 +1,422 @@
 import json
 import logging
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
  
 from beaker.container import NamespaceManager, Container
 from beaker.synchronization import file_synchronizer
 from beaker.util import verify_directory
-from beaker.exceptions import MissingCacheParameter
+from beaker.exceptions import MissingCacheParameter, InvalidCacheBackendError
 
 try:
     import cPickle as pickle
 except:
     import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
  
 log = logging.getLogger(__name__)
- 
+
+
+class PickleSerializer(object):
+    code = 1
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, payload):
+        return pickle.loads(payload)
+
+
+class JsonSerializer(object):
+    code = 2
+
+    def dumps(self, value):
+        return json.dumps(value, ensure_ascii=True)
+
+    def loads(self, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        return json.loads(payload)
+
+
+class MsgpackSerializer(object):
+    code = 3
+
+    def __init__(self):
+        if msgpack is None:
+            raise InvalidCacheBackendError("msgpack serializer requires the 'msgpack' library")
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class ZlibCompressor(object):
+    code = 1
+
+    def compress(self, payload):
+        return zlib.compress(payload)
+
+    def decompress(self, payload):
+        return zlib.decompress(payload)
+
+
+class Lz4Compressor(object):
+    code = 2
+
+    def __init__(self):
+        if lz4 is None:
+            raise InvalidCacheBackendError("lz4 compression requires the 'lz4' library")
+
+    def compress(self, payload):
+        return lz4.compress(payload)
+
+    def decompress(self, payload):
+        return lz4.decompress(payload)
+
+
+serializers = {
+    'pickle': PickleSerializer,
+    'json': JsonSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+compressors = {
+    'zlib': ZlibCompressor,
+    'lz4': Lz4Compressor,
+}
+
+
+def register_serializer(name, serializer_class):
+    """Register a serializer; its ``code`` must be unique and within 1-7."""
+    serializers[name] = serializer_class
+
+
+def register_compressor(name, compressor_class):
+    """Register a compressor; its ``code`` must be unique and within 1-3."""
+    compressors[name] = compressor_class
+
+
+class Codec(object):
+    """
+    Turns values into the payloads stored by the backends and back, using a
+    serializer and optionally compressing payloads of at least ``threshold``
+    bytes.
+
+    Payloads start with a header byte holding the serializer code in its low
+    three bits and the compressor code (0 for none) in the next two, so they
+    decode whatever the current settings are. Header bytes stay below 0x20,
+    which neither pickle nor json output starts with: payloads written before
+    the header was introduced are decoded with the configured serializer.
+    """
+    HEADER_LIMIT = 0x20
+
+    def __init__(self, serializer='pickle', compression=None, threshold=1024):
+        try:
+            self.serializer = serializers[serializer]()
+        except KeyError:
+            raise InvalidCacheBackendError("Unknown serializer: %s" % serializer)
+        self.compressor = None
+        if compression:
+            try:
+                self.compressor = compressors[compression]()
+            except KeyError:
+                raise InvalidCacheBackendError("Unknown compression: %s" % compression)
+        self.threshold = threshold
+        self._decoders = {}
+
+    def dumps(self, value):
+        payload = self.serializer.dumps(value)
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        header = self.serializer.code
+        if self.compressor is not None and len(payload) >= self.threshold:
+            payload = self.compressor.compress(payload)
+            header |= self.compressor.code << 3
+        return struct.pack('B', header) + payload
+
+    def loads(self, payload):
+        if not payload or ord(payload[:1]) >= self.HEADER_LIMIT:
+            return self.serializer.loads(payload)
+        serializer, compressor = self._decoder(ord(payload[:1]))
+        payload = payload[1:]
+        if compressor is not None:
+            payload = compressor.decompress(payload)
+        return serializer.loads(payload)
+
+    def _decoder(self, header):
+        if header not in self._decoders:
+            serializer = self._lookup(serializers, header & 0x7)
+            compressor = None
+            if header >> 3:
+                compressor = self._lookup(compressors, header >> 3)
+            self._decoders[header] = (serializer, compressor)
+        return self._decoders[header]
+
+    def _lookup(self, registry, code):
+        for cls in registry.values():
+            if cls.code == code:
+                return cls()
+        raise ValueError("Unknown value header code: %d" % code)
+
+
+def _pop_codec(params):
+    """Build the Codec described by the serializer, compression and
+    compress_threshold params, removing them from ``params``.
+
+    Returns the serializer name along with the codec.
+    """
+    serializer = params.pop('serializer', 'pickle')
+    codec = Codec(serializer,
+                  params.pop('compression', None),
+                  int(params.pop('compress_threshold', 1024)))
+    return serializer, codec
+
+
+def _split_url(url):
+    conn_params = {}
+    parts = url.split('?', 1)
+    if len(parts) > 1:
+        conn_params = dict(p.split('=', 1) for p in parts[1].split('&'))
+    return parts[0], conn_params
+
+
+def _pop_param(name, params, conn_params):
+    # Remove a param from both sources so it never reaches the client; the
+    # beaker param wins over the url query.
+    url_value = conn_params.pop(name, None)
+    value = params.pop(name, None)
+    return url_value if value is None else value
+
+
+def item_expiretime(value, expiretime=None):
+    #
+    # beaker.container.Value.set_value calls NamespaceManager.set_value
+    # however it (until version 1.6.4) never sets expiretime param.
+    #
+    # Checking "type(value) is tuple" is a compromise
+    # because Manager class can be instantiated outside container.py (See: session.py)
+    #
+    if (expiretime is None) and (type(value) is tuple):
+        expiretime = value[1]
+    return expiretime
+
+
+def _value_deadline(value, expiretime=None):
+    # Beaker stores (storedtime, expiretime, value) tuples.
+    if expiretime:
+        return time.time() + expiretime
+    if type(value) is tuple and len(value) > 1 and value[1]:
+        return value[0] + value[1]
+    return None
+
+
+class LocalCache(object):
+    """
+    Bounded in-process LRU cache whose entries expire at a deadline or after
+    ``ttl`` seconds, whichever comes first.
+
+    Values are kept deserialized, so they are shared by reference with every
+    caller reading them.
+
+    Callers filling the cache from the backend take the key's ``version``
+    first and pass it to ``set``, which then ignores values that may have
+    been invalidated while they were being fetched. Versions are counted
+    per key, in ``stripes`` slots keys are hashed into so that they take no
+    memory per key; clear() changes every version.
+    """
+    stripes = 4096
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._cleared = 0
+        self._versions = [0] * self.stripes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stripe(self, key):
+        return hash(key) % self.stripes
+
+    def version(self, key):
+        with self._lock:
+            return self._cleared, self._versions[self._stripe(key)]
+
+    def get(self, key):
+        with self._lock:
+            deadline, value = self._entries.pop(key)
+            if deadline is not None and deadline <= time.time():
+                raise KeyError(key)
+            self._entries[key] = (deadline, value)
+            return value
+
+    def set(self, key, value, deadline=None, version=None):
+        if self.ttl:
+            ttl_deadline = time.time() + self.ttl
+            if deadline is None or ttl_deadline < deadline:
+                deadline = ttl_deadline
+        with self._lock:
+            if version is not None and version != (self._cleared,
+                                                   self._versions[self._stripe(key)]):
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (deadline, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._versions[self._stripe(key)] += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._entries.clear()
+
+
+class LocalCacheMixin(object):
+    """
+    Serves reads from a process-wide LocalCache before going to the backend.
+
+    NoSqlManager puts this in front of the concrete manager class when the
+    ``l1_size`` param is given; local writes and deletes invalidate the
+    cached entry.
+    """
+    def __getitem__(self, key):
+        cache_key = self._format_key(key)
+        try:
+            return self.local_cache.get(cache_key)
+        except KeyError:
+            pass
+        version = self.local_cache.version(cache_key)
+        value = super(LocalCacheMixin, self).__getitem__(key)
+        self.local_cache.set(cache_key, value, _value_deadline(value), version)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self.local_cache.get(self._format_key(key))
+        except KeyError:
+            return super(LocalCacheMixin, self).__contains__(key)
+        return True
+
+    def set_value(self, key, value, expiretime=None):
+        super(LocalCacheMixin, self).set_value(key, value, expiretime)
+        self.local_cache.discard(self._format_key(key))
+
+    def __delitem__(self, key):
+        try:
+            super(LocalCacheMixin, self).__delitem__(key)
+        finally:
+            self.local_cache.discard(self._format_key(key))
+
+    def get_many(self, keys):
+        result = {}
+        missing = []
+        for key in keys:
+            try:
+                result[key] = self.local_cache.get(self._format_key(key))
+            except KeyError:
+                missing.append(key)
+        if missing:
+            versions = dict((key, self.local_cache.version(self._format_key(key)))
+                            for key in missing)
+            fetched = super(LocalCacheMixin, self).get_many(missing)
+            for key, value in fetched.items():
+                self.local_cache.set(self._format_key(key), value,
+                                     _value_deadline(value), versions[key])
+            result.update(fetched)
+        return result
+
+    def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = list(items)
+        super(LocalCacheMixin, self).set_many(items, expiretime)
+        for key, value in items:
+            self.local_cache.discard(self._format_key(key))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        try:
+            super(LocalCacheMixin, self).delete_many(keys)
+        finally:
+            for key in keys:
+                self.local_cache.discard(self._format_key(key))
+
+    def do_remove(self):
+        try:
+            super(LocalCacheMixin, self).do_remove()
+        finally:
+            self.local_cache.clear()
+
+
+class BackendLock(object):
+    """
+    Creation lock kept in the backend store itself, so it is honored by every
+    host sharing the cache.
+
+    Backends supporting it define ``_acquire_lock(key, token, timeout)`` and
+    ``_release_lock(key, token)`` on their manager; locks expire after ``timeout`` seconds in
+    case their holder dies. Tokens start with the time they were created at,
+    so backends can order competing requests by them.
+    """
+    poll_interval = 0.1
+
+    def __init__(self, manager, key, timeout):
+        self.manager = manager
+        self.key = key
+        self.timeout = timeout
+        self.token = '%017.6f-%s' % (time.time(), uuid.uuid4().hex)
+
+    def acquire(self, wait=True):
+        while not self.manager._acquire_lock(self.key, self.token, self.timeout):
+            if not wait:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def release(self):
+        self.manager._release_lock(self.key, self.token)
+
+    acquire_write_lock = acquire
+    release_write_lock = release
+
+
 class NoSqlManager(NamespaceManager):
+
+    local_caches = {}
+    local_cache_classes = {}
+
+    def __new__(cls, namespace, url=None, *args, **params):
+        # Put the in-process cache tier in front of the concrete backend
+        # class when one is configured (as a beaker param or in the url).
+        if issubclass(cls, LocalCacheMixin) or not (
+                params.get('l1_size') or (url and 'l1_size' in _split_url(url)[1])):
+            return super(NoSqlManager, cls).__new__(cls)
+        if cls not in cls.local_cache_classes:
+            cls.local_cache_classes[cls] = type(
+                cls.__name__, (LocalCacheMixin, cls), {'__module__': cls.__module__})
+        return super(NoSqlManager, cls).__new__(cls.local_cache_classes[cls])
+
     def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, expire=None, **params):
         NamespaceManager.__init__(self, namespace)
 
@@ -27,41 +430,102 @@ class NoSqlManager(NamespaceManager):
         if hasattr(self, 'lock_dir'):
             verify_directory(self.lock_dir)
 
-        # Specify the serializer to use (pickle or json?)
-        self.serializer = params.pop('serializer', 'pickle')
+        # Specify the serializer to use (see serializers) and, optionally,
+        # how to compress large payloads (see compressors).
+        self.serializer, self.codec = _pop_codec(params)
 
         self._expiretime = int(expire) if expire else None
 
-        conn_params = {}
-        parts = url.split('?', 1)
-        url = parts[0]
-        if len(parts) > 1:
-            conn_params = dict(p.split('=', 1) for p in parts[1].split('&'))
+        # Where creation locks live: 'file' (a file_synchronizer in lock_dir,
+        # local to this host) or 'backend' (see BackendLock).
+        self.creation_lock = params.pop('creation_lock', 'file')
+        if self.creation_lock not in ('file', 'backend'):
+            raise InvalidCacheBackendError("Unknown creation_lock: %s" % self.creation_lock)
+        if self.creation_lock == 'backend' and not hasattr(self, '_acquire_lock'):
+            raise InvalidCacheBackendError("%s does not support backend creation locks"
+                                           % type(self).__name__)
+        self.lock_timeout = float(params.pop('lock_timeout', 30))
 
-        host, port = url.split(':', 1)
+        # Stale-while-revalidate: keep values stale_ttl seconds past their
+        # expiry. Beaker then hands the stale value to every caller failing to
+        # get the creation lock while its holder regenerates it. With
+        # early_refresh_delta (the expected regeneration time in seconds) set,
+        # reads also report values as expired slightly ahead of time with a
+        # probability rising towards the expiry (scaled by early_refresh_beta).
+        self.stale_ttl = int(params.pop('stale_ttl', 0))
+        early_refresh_delta = params.pop('early_refresh_delta', None)
+        self.early_refresh_delta = float(early_refresh_delta) if early_refresh_delta else None
+        self.early_refresh_beta = float(params.pop('early_refresh_beta', 1))
+
+        url, conn_params = _split_url(url)
+
+        # Optional in-process cache tier (see LocalCacheMixin).
+        l1_size = _pop_param('l1_size', params, conn_params)
+        l1_ttl = _pop_param('l1_ttl', params, conn_params)
+        self.local_cache = None
+        if l1_size:
+            cache_key = self._local_cache_key(url, conn_params) + (int(l1_size), l1_ttl)
+            self.local_cache = self.local_caches.setdefault(
+                cache_key, LocalCache(int(l1_size), float(l1_ttl) if l1_ttl else None))
 
-        self.open_connection(host, int(port), **conn_params)
+        self.open_url(url, **conn_params)
+
+    def _local_cache_key(self, url, conn_params):
+        # Managers share a local cache only when they use the same store;
+        # backends add the params selecting a database, keyspace, bucket...
+        return (type(self).__name__, url, tuple(sorted(conn_params.items())))
+
+    def open_url(self, url, **params):
+        host, port = url.split(':', 1)
+        self.open_connection(host, int(port), **params)
 
     def open_connection(self, host, port):
         self.db_conn = None
 
     def get_creation_lock(self, key):
+        if self.creation_lock == 'backend':
+            return BackendLock(self, self._format_lock_key(key), self.lock_timeout)
         return file_synchronizer(
             identifier ="tccontainer/funclock/%s" % self.namespace,
             lock_dir = self.lock_dir)
 
     def _format_key(self, key):
-        return self.namespace + '_' 
+        return 'beaker:%s:%s' % (self.namespace, key)
+
+    def _format_lock_key(self, key):
+        # Kept outside of the namespace's key prefix so lock entries never
+        # show up in keys().
+        return 'lock:' + self._format_key(key)
+
+    def _dumps(self, value):
+        return self.codec.dumps(value)
+
+    def _loads(self, payload):
+        value = self.codec.loads(payload)
+        if self.early_refresh_delta and type(value) is tuple and len(value) == 3:
+            value = self._early_expire(value)
+        return value
+
+    def _early_expire(self, value):
+        storedtime, expiretime, payload = value
+        if not expiretime:
+            return value
+        # Probabilistic early expiration ("XFetch"): -log(U) is unbounded but
+        # usually small, so callers close to the expiry tend to refresh first.
+        now = time.time()
+        gap = -self.early_refresh_delta * self.early_refresh_beta * math.log(1 - random.random())
+        if now + gap >= storedtime + expiretime:
+            return (min(storedtime, now - expiretime), expiretime, payload)
+        return value
+
+    def _item_expiretime(self, value, expiretime=None):
+        expiretime = item_expiretime(value, expiretime)
+        if expiretime and self.stale_ttl:
+            expiretime += self.stale_ttl
+        return expiretime
 
     def __getitem__(self, key):
-        if self.serializer == 'json':
-            payload = self.db_conn.get(self._format_key(key))
-            if isinstance(payload, bytes):
-                return json.loads(payload.decode('utf-8'))
-            else:
-                return json.loads(payload)
-        else:
-            return pickle.loads(self.db_conn.get(self._format_key(key)))
+        return self._loads(self.db_conn.get(self._format_key(key)))
 
     def __contains__(self, key):
         return self.db_conn.has_key(self._format_key(key))
@@ -69,11 +533,8 @@ class NoSqlManager(NamespaceManager):
     def has_key(self, key):
         return key in self
 
-    def set_value(self, key, value):
-        if self.serializer == 'json':
-            self.db_conn[self._format_key(key)] = json.dumps(value, ensure_ascii=True)
-        else:
-            self.db_conn[self._format_key(key)] =  pickle.dumps(value, 2)
+    def set_value(self, key, value, expiretime=None):
+        self.db_conn[self._format_key(key)] = self._dumps(value)
 
     def __setitem__(self, key, value):
         self.set_value(key, value, self._expiretime)
@@ -81,6 +542,40 @@ class NoSqlManager(NamespaceManager):
     def __delitem__(self, key):
         del self.db_conn[self._format_key(key)]
 
+    def get_many(self, keys):
+        """Fetch several keys at once.
+
+        Returns a dict holding the values of the keys that were found.
+        Backends override this with a single round-trip implementation; the
+        default falls back to one lookup per key.
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self[key]
+            except KeyError:
+                pass
+        return result
+
+    def set_many(self, items, expiretime=None):
+        """Store several values at once.
+
+        ``items`` is a dict or an iterable of ``(key, value)`` pairs. The
+        expiry of each item is derived the same way as in ``set_value``.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            self.set_value(key, value, expiretime)
+
+    def delete_many(self, keys):
+        """Remove several keys at once, ignoring the ones that are missing."""
+        for key in keys:
+            try:
+                del self[key]
+            except KeyError:
+                pass
+
     def do_remove(self):
         self.db_conn.clear()
 
@@ -26,12 +26,15 @@ for the raw Tyrant protocol::
 import math
 import socket
 import struct
+import threading
+import time
 import UserDict
 
 __version__ = '1.1.17'
 
 __all__ = [
-    'Tyrant', 'TyrantError', 'PyTyrant',
+    'Tyrant', 'TyrantError', 'TyrantConnectionError', 'PyTyrant',
+    'PyTyrantPool', 'PooledPyTyrant', 'TyrantPipeline',
     'RDBMONOULOG', 'RDBXOLCKREC', 'RDBXOLCKGLB',
 ]
 
@@ -39,6 +42,10 @@ class TyrantError(Exception):
     pass
 
 
+class TyrantConnectionError(TyrantError):
+    pass
+
+
 DEFAULT_PORT = 1978
 MAGIC = 0xc8
 
@@ -152,15 +159,66 @@ def _tDouble(code, key, integ, fract):
     ]
 
 
+class BufferedSocket(object):
+    """
+    Socket wrapper reading replies through a reusable receive buffer.
+
+    Small fields (lengths, status bytes) are served from data already
+    received instead of costing a recv each; values larger than the buffer
+    are received straight into a buffer of their own.
+    """
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+    def _recv_into(self, view):
+        n = self.sock.recv_into(view)
+        if not n:
+            raise TyrantConnectionError("Connection closed by server")
+        return n
+
+    def read(self, size):
+        available = self.end - self.start
+        if available >= size:
+            data = self.view[self.start:self.start + size].tobytes()
+            self.start += size
+            return data
+
+        if size > len(self.buf):
+            out = bytearray(size)
+            out[:available] = self.view[self.start:self.end]
+            self.start = self.end = 0
+            view = memoryview(out)
+            while available < size:
+                available += self._recv_into(view[available:])
+            return bytes(out)
+
+        # Compact what is left at the front of the buffer only when more
+        # room is needed.
+        if self.start:
+            self.buf[:available] = self.view[self.start:self.end]
+            self.start, self.end = 0, available
+        while self.end < size:
+            self.end += self._recv_into(self.view[self.end:])
+        self.start = size
+        return self.view[:size].tobytes()
+
+
 def socksend(sock, lst):
     sock.sendall(''.join(lst))
 
 
 def sockrecv(sock, bytes):
-    d = ''
-    while len(d) < bytes:
-        d += sock.recv(min(8192, bytes - len(d)))
-    return d
+    return sock.read(bytes)
 
 
 def socksuccess(sock):
@@ -338,6 +396,242 @@ class PyTyrant(object, UserDict.DictMixin):
     def addint(self, key, num):
         self.t.addint(key, num)
 
+    def pipeline(self):
+        return self.t.pipeline()
+
+
+class PyTyrantPool(object):
+    """
+    Thread-safe pool of PyTyrant connections to one server.
+
+    Every call checks a connection out for its sole use, so threads never
+    share a socket. Connections idle for more than ``check_interval``
+    seconds are probed before reuse, and a call failing on a broken
+    connection is retried once on a new one.
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, max_size=10, check_interval=30):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.idle = []
+        self.size = 0
+        self.cond = threading.Condition()
+
+    def _connect(self):
+        return PyTyrant.open(self.host, self.port)
+
+    def checkout(self):
+        with self.cond:
+            while not self.idle and self.size >= self.max_size:
+                self.cond.wait()
+            if self.idle:
+                conn, last_used = self.idle.pop()
+            else:
+                self.size += 1
+                conn = last_used = None
+        try:
+            if conn is None:
+                return self._connect()
+            if time.time() - last_used > self.check_interval:
+                try:
+                    len(conn)
+                except (socket.error, TyrantError):
+                    conn.close()
+                    return self._connect()
+            return conn
+        except Exception:
+            self.discard(None)
+            raise
+
+    def checkin(self, conn):
+        with self.cond:
+            self.idle.append((conn, time.time()))
+            self.cond.notify()
+
+    def discard(self, conn):
+        if conn is not None:
+            try:
+                conn.close()
+            except socket.error:
+                pass
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def run(self, func):
+        """Call func(conn) with a checked out connection"""
+        for attempt in (0, 1):
+            conn = self.checkout()
+            try:
+                result = func(conn)
+            except (socket.error, TyrantConnectionError):
+                self.discard(conn)
+                if attempt:
+                    raise
+            except (TyrantError, KeyError):
+                # Raised once the reply was read in full.
+                self.checkin(conn)
+                raise
+            except:
+                # Part of a reply may be left unread on the socket.
+                self.discard(conn)
+                raise
+            else:
+                self.checkin(conn)
+                return result
+
+
+class PooledPyTyrant(object):
+    """
+    PyTyrant stand-in running each call on a connection of a PyTyrantPool.
+
+    Calls returning generators (iterkeys, __iter__) are not supported since
+    the connection is given back as soon as the call returns.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _call(self, name, *args, **kw):
+        return self.pool.run(lambda conn: getattr(conn, name)(*args, **kw))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kw: self._call(name, *args, **kw)
+
+    def __contains__(self, key):
+        return self._call('__contains__', key)
+
+    def __getitem__(self, key):
+        return self._call('__getitem__', key)
+
+    def __setitem__(self, key, value):
+        self._call('__setitem__', key, value)
+
+    def __delitem__(self, key):
+        self._call('__delitem__', key)
+
+    def __len__(self):
+        return self._call('__len__')
+
+    def pipeline(self):
+        return PooledTyrantPipeline(self.pool)
+
+
+def _read_success(sock):
+    socksuccess(sock)
+
+
+def _read_str(sock):
+    socksuccess(sock)
+    return sockstr(sock)
+
+
+def _read_len(sock):
+    socksuccess(sock)
+    return socklen(sock)
+
+
+def _read_list(sock):
+    try:
+        socksuccess(sock)
+    finally:
+        numrecs = socklen(sock)
+    return [sockstr(sock) for i in xrange(numrecs)]
+
+
+class TyrantPipeline(object):
+    """
+    Queues Tyrant commands and sends them all with a single sendall, then
+    reads the replies in order::
+
+        p = t.pipeline()
+        p.put('a', '1')
+        p.get('a')
+        p.get('missing')
+        p.execute()  # [None, '1', TyrantError(1,)]
+
+    A command failing on the server yields its TyrantError in the results
+    instead of aborting the rest of the pipeline.
+    """
+    def __init__(self, tyrant=None):
+        self.tyrant = tyrant
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _queue(self, request, reader):
+        self.commands.append((request, reader))
+
+    def put(self, key, value):
+        self._queue(_t2(C.put, key, value), _read_success)
+
+    def putkeep(self, key, value):
+        self._queue(_t2(C.putkeep, key, value), _read_success)
+
+    def putcat(self, key, value):
+        self._queue(_t2(C.putcat, key, value), _read_success)
+
+    def putshl(self, key, value, width):
+        self._queue(_t2W(C.putshl, key, value, width), _read_success)
+
+    def putnr(self, key, value):
+        self._queue(_t2(C.putnr, key, value), None)
+
+    def out(self, key):
+        self._queue(_t1(C.out, key), _read_success)
+
+    def get(self, key):
+        self._queue(_t1(C.get, key), _read_str)
+
+    def vsiz(self, key):
+        self._queue(_t1(C.vsiz, key), _read_len)
+
+    def addint(self, key, num):
+        self._queue(_t1M(C.addint, key, num), _read_len)
+
+    def ext(self, func, opts, key, value):
+        self._queue(_t3F(C.ext, func, opts, key, value), _read_str)
+
+    def misc(self, func, opts, args):
+        self._queue(_t1FN(C.misc, func, opts, args), _read_list)
+
+    def execute(self, tyrant=None):
+        """Send the queued commands and return their results in order"""
+        tyrant = tyrant or self.tyrant
+        commands = self.commands
+        if not commands:
+            return []
+        request = []
+        for parts, reader in commands:
+            request.extend(parts)
+        socksend(tyrant.sock, request)
+        results = []
+        for parts, reader in commands:
+            if reader is None:
+                results.append(None)
+                continue
+            try:
+                results.append(reader(tyrant.sock))
+            except TyrantConnectionError:
+                raise
+            except TyrantError as e:
+                results.append(e)
+        self.commands = []
+        return results
+
+
+class PooledTyrantPipeline(TyrantPipeline):
+    """TyrantPipeline executed on a connection checked out of a PyTyrantPool"""
+    def __init__(self, pool):
+        TyrantPipeline.__init__(self)
+        self.pool = pool
+
+    def execute(self):
+        return self.pool.run(lambda conn: TyrantPipeline.execute(self, conn.t))
+
 
 class Tyrant(object):
     @classmethod
@@ -348,11 +642,18 @@ class Tyrant(object):
         return cls(sock)
 
     def __init__(self, sock):
+        if not isinstance(sock, BufferedSocket):
+            sock = BufferedSocket(sock)
         self.sock = sock
 
     def close(self):
         self.sock.close()
 
+    def pipeline(self):
+        """Get a TyrantPipeline sending its commands over this connection
+        """
+        return TyrantPipeline(self)
+
     def put(self, key, value):
         """Unconditionally set key to value
         """
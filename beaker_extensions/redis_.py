@@ -1,21 +1,138 @@
-import json
 import logging
+import os
+import re
+import struct
+import threading
+import time
+from bisect import bisect
+from hashlib import md5
+from itertools import chain
 from beaker.exceptions import InvalidCacheBackendError
 
 from beaker_extensions.nosql import Container
 from beaker_extensions.nosql import NoSqlManager
-from beaker_extensions.nosql import pickle
 
 try:
     from redis import StrictRedis, ConnectionPool
 except ImportError:
     raise InvalidCacheBackendError("Redis cache backend requires the 'redis' library")
 
+try:
+    from redis.cluster import RedisCluster, ClusterNode
+except ImportError:
+    RedisCluster = None
+
 log = logging.getLogger(__name__)
 
+# Published in place of a key to ask subscribers to drop their whole cache.
+INVALIDATE_ALL = '*'
+
+# Only delete a creation lock still held with our token.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _pop_redis_params(manager, params):
+    # Params shared by RedisManager and AsyncRedisManager.
+    manager.db = params.pop('db', None)
+    manager.dbpass = params.pop('password', None)
+    manager.scan_count = int(params.pop('scan_count', 1000))
+    manager.remove_batch_size = int(params.pop('remove_batch_size', 500))
+
+
+def _format_redis_key(namespace, key):
+    return 'beaker:%s:%s' % (namespace, key.replace(' ', '\302\267'))
+
+
+def _format_redis_pattern(namespace):
+    # Escape glob characters so SCAN MATCH only hits this namespace.
+    namespace = re.sub(r'([\\*?\[\]])', r'\\\1', namespace)
+    return 'beaker:%s:*' % namespace
+
+
+def _format_pool_key(host, port, db):
+    return '{0}:{1}:{2}'.format(host, port, db)
+
+
+class InvalidationSubscriber(threading.Thread):
+    """
+    Background thread evicting entries of a LocalCache whenever another
+    process publishes their keys on the invalidation channel.
+    """
+    def __init__(self, client, channel, local_cache):
+        threading.Thread.__init__(self, name='beaker-redis-invalidation')
+        self.daemon = True
+        self.client = client
+        self.channel = channel
+        self.local_cache = local_cache
+
+    def run(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Invalidations may have been missed while not subscribed.
+                self.local_cache.clear()
+                for message in pubsub.listen():
+                    self.invalidate(message['data'])
+            except Exception:
+                log.exception("Redis invalidation subscriber for %s failed, reconnecting",
+                              self.channel)
+                time.sleep(1)
+
+    def invalidate(self, key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if key == INVALIDATE_ALL:
+            self.local_cache.clear()
+        else:
+            self.local_cache.discard(key)
+
+
+class HashRing(object):
+    """
+    Ketama-style consistent hash ring mapping keys onto weighted nodes.
+
+    ``nodes`` is a list of ``(node, weight)`` pairs; every unit of weight
+    places 160 points on the ring.
+    """
+    points_per_weight = 40
+
+    def __init__(self, nodes):
+        ring = {}
+        for node, weight in nodes:
+            for i in range(int(self.points_per_weight * weight)):
+                digest = md5(('%s-%d' % (node, i)).encode('utf-8')).digest()
+                for j in range(4):
+                    ring[struct.unpack('<I', digest[j * 4:j * 4 + 4])[0]] = node
+        self.points = sorted(ring)
+        self.nodes = [ring[point] for point in self.points]
+
+    def get_node(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        point = struct.unpack('<I', md5(key).digest()[:4])[0]
+        return self.nodes[bisect(self.points, point) % len(self.points)]
+
+
 class RedisManager(NoSqlManager):
+    """
+    Redis backend for beaker.
+
+    The url may list several comma separated nodes, optionally weighted with
+    a third field (``host1:6379:2,host2:6379``). Keys are then spread over
+    the nodes with a consistent hash ring, or routed by Redis Cluster hash
+    slots when the ``cluster`` param is true.
+    """
 
     connection_pools = {}
+    cluster_clients = {}
+    hash_rings = {}
+    invalidation_subscribers = {}
 
     def __init__(self,
                  namespace,
@@ -23,8 +140,13 @@ class RedisManager(NoSqlManager):
                  data_dir=None,
                  lock_dir=None,
                  **params):
-        self.db = params.pop('db', None)
-        self.dbpass = params.pop('password', None)
+        _pop_redis_params(self, params)
+        # Channel used to keep the l1_size local caches of several processes
+        # coherent; only meaningful together with l1_size.
+        self.invalidation_channel = params.pop('invalidation_channel', None)
+        self.cluster = str(params.pop('cluster', False)).lower() in ('true', '1', 'yes')
+        self.ring = None
+        self.ring_conns = {}
         NoSqlManager.__init__(self,
                               namespace,
                               url=url,
@@ -32,56 +154,221 @@ class RedisManager(NoSqlManager):
                               lock_dir=lock_dir,
                               **params)
 
+    def _local_cache_key(self, url, conn_params):
+        return NoSqlManager._local_cache_key(self, url, conn_params) + (self.db, self.dbpass)
+
+    def open_url(self, url, **params):
+        nodes = []
+        for node in url.split(','):
+            parts = node.strip().split(':')
+            weight = float(parts[2]) if len(parts) > 2 else 1
+            nodes.append((parts[0], int(parts[1]), weight))
+
+        if self.cluster:
+            self.open_cluster_connection(url, nodes, **params)
+        elif len(nodes) == 1:
+            self.open_connection(nodes[0][0], nodes[0][1], **params)
+        else:
+            if url not in self.hash_rings:
+                self.hash_rings[url] = HashRing(
+                    [('%s:%s' % (host, port), weight) for host, port, weight in nodes])
+            self.ring = self.hash_rings[url]
+            for host, port, weight in nodes:
+                self.ring_conns['%s:%s' % (host, port)] = self._connect(host, port, **params)
+            # The first node carries the invalidation channel.
+            self.db_conn = self.ring_conns['%s:%s' % nodes[0][:2]]
+            self._start_invalidation_subscriber()
+
     def open_connection(self, host, port, **params):
+        self.db_conn = self._connect(host, port, **params)
+        self._start_invalidation_subscriber()
+
+    def open_cluster_connection(self, url, nodes, **params):
+        if RedisCluster is None:
+            raise InvalidCacheBackendError("Redis cluster support requires redis>=4.1")
+        if url not in self.cluster_clients:
+            self.cluster_clients[url] = RedisCluster(
+                startup_nodes=[ClusterNode(host, port) for host, port, weight in nodes],
+                password=self.dbpass,
+                **params)
+        self.db_conn = self.cluster_clients[url]
+        self._start_invalidation_subscriber()
+
+    def _connect(self, host, port, **params):
         pool_key = self._format_pool_key(host, port, self.db)
         if pool_key not in self.connection_pools:
             self.connection_pools[pool_key] = ConnectionPool(host=host,
                                                              port=port,
                                                              db=self.db,
                                                              password=self.dbpass)
-        self.db_conn = StrictRedis(connection_pool=self.connection_pools[pool_key],
-                                   **params)
+        return StrictRedis(connection_pool=self.connection_pools[pool_key],
+                           **params)
+
+    def _start_invalidation_subscriber(self):
+        if self.local_cache is None or not self.invalidation_channel:
+            return
+        # Threads do not survive a fork, so each process gets its own.
+        subscriber_key = (id(self.local_cache), self.invalidation_channel, os.getpid())
+        if subscriber_key not in self.invalidation_subscribers:
+            subscriber = InvalidationSubscriber(self.db_conn,
+                                                self.invalidation_channel,
+                                                self.local_cache)
+            if self.invalidation_subscribers.setdefault(subscriber_key, subscriber) is subscriber:
+                subscriber.start()
+
+    def _conn_for(self, key):
+        if self.ring is None:
+            return self.db_conn
+        return self.ring_conns[self.ring.get_node(key)]
+
+    def _connections(self):
+        if self.ring is None:
+            return [self.db_conn]
+        return list(self.ring_conns.values())
+
+    def _group_by_connection(self, keys):
+        """Split formatted keys into ``(connection, keys)`` groups."""
+        if self.ring is None:
+            return [(self.db_conn, list(keys))]
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_node(key), []).append(key)
+        return [(self.ring_conns[node], node_keys) for node, node_keys in groups.items()]
+
+    def _publish_invalidation(self, keys):
+        if self.local_cache is None or not self.invalidation_channel:
+            return
+        if len(keys) == 1:
+            self.db_conn.publish(self.invalidation_channel, keys[0])
+        else:
+            pipe = self.db_conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.publish(self.invalidation_channel, key)
+            pipe.execute()
+
+    def _acquire_lock(self, key, token, timeout):
+        return bool(self._conn_for(key).set(key, token, nx=True, px=int(timeout * 1000)))
+
+    def _release_lock(self, key, token):
+        self._conn_for(key).eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+
+    def __getitem__(self, key):
+        redis_key = self._format_key(key)
+        payload = self._conn_for(redis_key).get(redis_key)
+        if payload is None:
+            raise KeyError(key)
+        return self._loads(payload)
 
     def __contains__(self, key):
-        return self.db_conn.exists(self._format_key(key))
+        key = self._format_key(key)
+        return self._conn_for(key).exists(key)
 
     def set_value(self, key, value, expiretime=None):
         key = self._format_key(key)
-
-        #
-        # beaker.container.Value.set_value calls NamespaceManager.set_value
-        # however it (until version 1.6.4) never sets expiretime param.
-        #
-        # Checking "type(value) is tuple" is a compromise
-        # because Manager class can be instantiated outside container.py (See: session.py)
-        #
-        if (expiretime is None) and (type(value) is tuple):
-            expiretime = value[1]
-
-        if self.serializer == 'json':
-            serialized_value = json.dumps(value, ensure_ascii=True)
-        else:
-            serialized_value = pickle.dumps(value, 2)
+        expiretime = self._item_expiretime(value, expiretime)
+        serialized_value = self._dumps(value)
 
         if expiretime:
-            self.db_conn.setex(key, expiretime, serialized_value)
+            self._conn_for(key).setex(key, expiretime, serialized_value)
         else:
-            self.db_conn.set(key, serialized_value)
+            self._conn_for(key).set(key, serialized_value)
+        self._publish_invalidation([key])
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        formatted_keys = dict((self._format_key(key), key) for key in keys)
+        result = {}
+        for conn, conn_keys in self._group_by_connection(formatted_keys):
+            # Cluster clients can only MGET keys sharing a hash slot.
+            mget = getattr(conn, 'mget_nonatomic', conn.mget)
+            for key, payload in zip(conn_keys, mget(conn_keys)):
+                if payload is not None:
+                    result[formatted_keys[key]] = self._loads(payload)
+        return result
+
+    def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        values = {}
+        for key, value in items:
+            values[self._format_key(key)] = value
+        for conn, conn_keys in self._group_by_connection(values):
+            pipe = conn.pipeline(transaction=False)
+            for key in conn_keys:
+                value = values[key]
+                item_expiretime = self._item_expiretime(value, expiretime)
+                serialized_value = self._dumps(value)
+                if item_expiretime:
+                    pipe.setex(key, item_expiretime, serialized_value)
+                else:
+                    pipe.set(key, serialized_value)
+            pipe.execute()
+        if values:
+            self._publish_invalidation(list(values))
+
+    def delete_many(self, keys):
+        keys = [self._format_key(key) for key in keys]
+        if keys:
+            for conn, conn_keys in self._group_by_connection(keys):
+                conn.delete(*conn_keys)
+            self._publish_invalidation(keys)
 
     def __delitem__(self, key):
-        self.db_conn.delete(self._format_key(key))
+        key = self._format_key(key)
+        self._conn_for(key).delete(key)
+        self._publish_invalidation([key])
 
     def _format_key(self, key):
-        return 'beaker:%s:%s' % (self.namespace, key.replace(' ', '\302\267'))
+        return _format_redis_key(self.namespace, key)
+
+    def _format_pattern(self):
+        return _format_redis_pattern(self.namespace)
 
     def _format_pool_key(self, host, port, db):
-        return '{0}:{1}:{2}'.format(host, port, self.db)
+        return _format_pool_key(host, port, db)
 
     def do_remove(self):
-        self.db_conn.flush()
+        # Only drop this namespace: stream its keys through SCAN and UNLINK
+        # them in pipelined batches so the server never blocks on one call.
+        for conn in self._connections():
+            batch = []
+            for key in self._scan_iter(conn):
+                batch.append(key)
+                if len(batch) >= self.remove_batch_size:
+                    self._unlink(conn, batch)
+                    batch = []
+            if batch:
+                self._unlink(conn, batch)
+        self._publish_invalidation([INVALIDATE_ALL])
+
+    def _unlink(self, conn, keys):
+        if self.cluster:
+            # Cluster pipelines refuse multi-key UNLINK; the client itself
+            # splits the keys by hash slot.
+            conn.unlink(*keys)
+        else:
+            pipe = conn.pipeline(transaction=False)
+            pipe.unlink(*keys)
+            pipe.execute()
+
+    def _scan_iter(self, conn, count=None):
+        return conn.scan_iter(match=self._format_pattern(),
+                              count=count or self.scan_count)
+
+    def iterkeys(self, count=None):
+        """Incrementally iterate over the keys of this namespace.
+
+        Uses SCAN rather than KEYS so that large keyspaces never block the
+        server; ``count`` (default: the ``scan_count`` param) is passed on as
+        the SCAN COUNT hint. Every node is scanned in turn.
+        """
+        return chain.from_iterable(self._scan_iter(conn, count)
+                                   for conn in self._connections())
 
     def keys(self):
-        return self.db_conn.keys('beaker:%s:*' % self.namespace)
+        return list(self.iterkeys())
 
 
 class RedisContainer(Container):
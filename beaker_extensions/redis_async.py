@@ -0,0 +1,146 @@
+import logging
+from beaker.exceptions import InvalidCacheBackendError, MissingCacheParameter
+
+from beaker_extensions.nosql import _pop_codec
+from beaker_extensions.nosql import _split_url
+from beaker_extensions.nosql import item_expiretime
+from beaker_extensions.redis_ import _format_pool_key
+from beaker_extensions.redis_ import _format_redis_key
+from beaker_extensions.redis_ import _format_redis_pattern
+from beaker_extensions.redis_ import _pop_redis_params
+
+try:
+    from redis.asyncio import StrictRedis, ConnectionPool
+except ImportError:
+    raise InvalidCacheBackendError("Async Redis cache backend requires the 'redis' library (>= 4.2)")
+
+log = logging.getLogger(__name__)
+
+
+class AsyncRedisManager(object):
+    """
+    asyncio counterpart of RedisManager.
+
+    Reads and writes the same keys and payloads, so both managers can share
+    data, but every operation is a coroutine::
+
+        manager = AsyncRedisManager('fragments', url='127.0.0.1:6379')
+        await manager.set_value('sidebar', html, 300)
+        html = await manager.get('sidebar')
+
+    Connection pools are shared per host, port and db, so managers should be
+    used from a single event loop.
+
+    Only single node urls are supported, and the cluster, l1_size,
+    invalidation_channel, stale_ttl, early_refresh_* and creation_lock params
+    of RedisManager are not.
+    """
+
+    connection_pools = {}
+
+    def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, expire=None, **params):
+        if not url:
+            raise MissingCacheParameter("url is required")
+
+        self.namespace = namespace
+        _pop_redis_params(self, params)
+        self.serializer, self.codec = _pop_codec(params)
+
+        self._expiretime = int(expire) if expire else None
+
+        url, conn_params = _split_url(url)
+        if ',' in url or url.count(':') != 1:
+            raise InvalidCacheBackendError(
+                "AsyncRedisManager only supports a single host:port url")
+        host, port = url.split(':')
+        self.open_connection(host, int(port), **conn_params)
+
+    def open_connection(self, host, port, **params):
+        pool_key = self._format_pool_key(host, port, self.db)
+        if pool_key not in self.connection_pools:
+            self.connection_pools[pool_key] = ConnectionPool(host=host,
+                                                             port=port,
+                                                             db=self.db,
+                                                             password=self.dbpass)
+        self.db_conn = StrictRedis(connection_pool=self.connection_pools[pool_key],
+                                   **params)
+
+    def _format_key(self, key):
+        return _format_redis_key(self.namespace, key)
+
+    def _format_pattern(self):
+        return _format_redis_pattern(self.namespace)
+
+    def _format_pool_key(self, host, port, db):
+        return _format_pool_key(host, port, db)
+
+    async def get(self, key):
+        payload = await self.db_conn.get(self._format_key(key))
+        if payload is None:
+            raise KeyError(key)
+        return self.codec.loads(payload)
+
+    async def contains(self, key):
+        return bool(await self.db_conn.exists(self._format_key(key)))
+
+    async def set_value(self, key, value, expiretime=None):
+        key = self._format_key(key)
+        expiretime = item_expiretime(value, expiretime)
+        serialized_value = self.codec.dumps(value)
+
+        if expiretime:
+            await self.db_conn.setex(key, expiretime, serialized_value)
+        else:
+            await self.db_conn.set(key, serialized_value)
+
+    async def set(self, key, value):
+        await self.set_value(key, value, self._expiretime)
+
+    async def delete(self, key):
+        await self.db_conn.delete(self._format_key(key))
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        payloads = await self.db_conn.mget([self._format_key(key) for key in keys])
+        return dict((key, self.codec.loads(payload))
+                    for key, payload in zip(keys, payloads)
+                    if payload is not None)
+
+    async def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        pipe = self.db_conn.pipeline(transaction=False)
+        for key, value in items:
+            key = self._format_key(key)
+            value_expiretime = item_expiretime(value, expiretime)
+            serialized_value = self.codec.dumps(value)
+            if value_expiretime:
+                pipe.setex(key, value_expiretime, serialized_value)
+            else:
+                pipe.set(key, serialized_value)
+        await pipe.execute()
+
+    async def delete_many(self, keys):
+        keys = [self._format_key(key) for key in keys]
+        if keys:
+            await self.db_conn.delete(*keys)
+
+    async def do_remove(self):
+        batch = []
+        async for key in self.iterkeys():
+            batch.append(key)
+            if len(batch) >= self.remove_batch_size:
+                await self.db_conn.unlink(*batch)
+                batch = []
+        if batch:
+            await self.db_conn.unlink(*batch)
+
+    def iterkeys(self, count=None):
+        """Asynchronously iterate over the keys of this namespace using SCAN."""
+        return self.db_conn.scan_iter(match=self._format_pattern(),
+                                      count=count or self.scan_count)
+
+    async def keys(self):
+        return [key async for key in self.iterkeys()]
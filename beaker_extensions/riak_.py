@@ -1,4 +1,6 @@
 import logging
+from collections import deque
+from multiprocessing.pool import ThreadPool
 from beaker.exceptions import InvalidCacheBackendError
 
 from beaker_extensions.nosql import Container
@@ -11,42 +13,142 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+# Secondary index every stored object is tagged with its namespace in.
+NAMESPACE_INDEX = 'beaker_namespace_bin'
+
 class RiakManager(NoSqlManager):
     '''
-    Riak Python client packages data in JSON by default.
+    Values are encoded with the configured serializer and stored as opaque
+    binary objects rather than through the Riak client's JSON packing.
+
+    Writes are blind (no fetch before the store) by default, relying on the
+    bucket resolving concurrent writes by last-write-wins; set write_mode to
+    'head' to fetch the object's vector clock (but not its value) first.
+
+    Everything goes to the ``bucket`` bucket (default 'beaker_cache'), or to
+    one '<bucket>:<namespace>' bucket per namespace with bucket_per_namespace
+    set. Bucket properties such as n_val, r, w, dw, allow_mult or backend can
+    be given as params and are applied once per process and bucket.
+
+    Objects are tagged with their namespace in a secondary index, which
+    keys() and do_remove() page through, so the bucket's backend has to
+    support secondary indexes (leveldb or memory).
     '''
+
+    clients = {}
+    configured_buckets = set()
+    bucket_property_params = ('n_val', 'r', 'w', 'dw', 'rw', 'pr', 'pw',
+                              'allow_mult', 'last_write_wins', 'backend')
+
     def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, **params):
+        self.bucket_name = params.pop('bucket', 'beaker_cache')
+        self.bucket_per_namespace = str(params.pop('bucket_per_namespace', False)).lower() in ('true', '1', 'yes')
+        self.write_mode = params.pop('write_mode', 'blind')
+        self.page_size = int(params.pop('page_size', 1000))
+        self.remove_batch_size = int(params.pop('remove_batch_size', 100))
+        self.remove_workers = int(params.pop('remove_workers', 8))
+        self.bucket_properties = {}
+        for name in self.bucket_property_params:
+            if name in params:
+                self.bucket_properties[name] = self._bucket_property(params.pop(name))
         NoSqlManager.__init__(self, namespace, url=url, data_dir=data_dir, lock_dir=lock_dir, **params)
 
+    def _bucket_property(self, value):
+        if str(value).lower() in ('true', 'false'):
+            return str(value).lower() == 'true'
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    def _local_cache_key(self, url, conn_params):
+        return NoSqlManager._local_cache_key(self, url, conn_params) + (
+            self.bucket_name, self.bucket_per_namespace)
+
     def open_connection(self, host, port):
-        self.db_conn = riak.RiakClient(protocol='pbc', host=host, pb_port=int(port))
-        self.bucket = self.db_conn.bucket('beaker_cache')
+        client_key = '%s:%s' % (host, port)
+        if client_key not in self.clients:
+            self.clients.setdefault(
+                client_key, riak.RiakClient(protocol='pbc', host=host, pb_port=int(port)))
+        self.db_conn = self.clients[client_key]
+
+        bucket_name = self.bucket_name
+        if self.bucket_per_namespace:
+            bucket_name = '%s:%s' % (bucket_name, self.namespace)
+        self.bucket = self.db_conn.bucket(bucket_name)
+        if self.bucket_properties and (client_key, bucket_name) not in self.configured_buckets:
+            self.bucket.set_properties(self.bucket_properties)
+            self.configured_buckets.add((client_key, bucket_name))
 
     def __contains__(self, key):
-        return self.bucket.get(self._format_key(key)).exists
+        return self.bucket.get(self._format_key(key), head_only=True).exists
 
-    def set_value(self, key, value):
-        val = self.bucket.get(self._format_key(key))
-        if not val.exists:
-            self.bucket.new(self._format_key(key), value).store()
+    def set_value(self, key, value, expiretime=None):
+        key = self._format_key(key)
+        if self.write_mode == 'head':
+            val = self.bucket.get(key, head_only=True)
         else:
-            val.data = value
-            val.store()
+            val = self.bucket.new(key)
+        val.encoded_data = self._dumps(value)
+        val.content_type = 'application/octet-stream'
+        val.add_index(NAMESPACE_INDEX, self.namespace)
+        val.store(return_body=False)
 
     def __getitem__(self, key):
-        return self.bucket.get(self._format_key(key)).data
+        val = self.bucket.get(self._format_key(key))
+        if not val.exists:
+            raise KeyError(key)
+        if val.content_type == 'application/json':
+            # Stored before values went through the codec: JSON packed by
+            # the Riak client.
+            return val.data
+        return self._loads(val.encoded_data)
 
     def __delitem__(self, key):
-        self.bucket.get(self._format_key(key)).delete()
+        self.bucket.delete(self._format_key(key))
 
     def _format_key(self, key):
         return 'beaker:%s:%s' % (self.namespace, key.replace(' ', '\302\267'))
 
+    def _delete_keys(self, keys):
+        for key in keys:
+            self.bucket.delete(key)
+
     def do_remove(self):
-        raise Exception("Unimplemented")
+        # Spread the deletes over a pool of threads (the client pools its
+        # connections), keeping a few batches queued per worker at most.
+        pool = ThreadPool(self.remove_workers)
+        pending = deque()
+        try:
+            batch = []
+            for key in self.iterkeys():
+                batch.append(key)
+                if len(batch) >= self.remove_batch_size:
+                    pending.append(pool.apply_async(self._delete_keys, (batch,)))
+                    batch = []
+                    if len(pending) >= 2 * self.remove_workers:
+                        pending.popleft().get()
+            if batch:
+                pending.append(pool.apply_async(self._delete_keys, (batch,)))
+            while pending:
+                pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def iterkeys(self):
+        """Stream the keys of this namespace from its secondary index,
+        page_size keys per page."""
+        for page in self.bucket.paginate_stream_index(NAMESPACE_INDEX, self.namespace,
+                                                      max_results=self.page_size):
+            try:
+                for key in page:
+                    yield key
+            finally:
+                page.close()
 
     def keys(self):
-        raise Exception("Unimplemented")
+        return list(self.iterkeys())
 
 
 class RiakContainer(Container):
@@ -1,42 +1,173 @@
 import logging
+import uuid
 from beaker.exceptions import InvalidCacheBackendError
 
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
 from beaker_extensions.nosql import Container
 from beaker_extensions.nosql import NoSqlManager
-from beaker_extensions.nosql import pickle
 
 try:
-    from ringogw import Ringo
+    from ringogw import Ringo, ReplyException
 except ImportError:
     raise InvalidCacheBackendError("Ringo cache backend requires the 'ringogw' library")
 
 log = logging.getLogger(__name__)
 
+# Ringo never deletes anything: removed keys get this value appended, which
+# no encoded value can be equal to.
+TOMBSTONE = ''
+
 class RingoManager(NoSqlManager):
+    """
+    Ringo backend for beaker.
+
+    Ringo is append-only, so the latest value written for a key is its
+    current one and deleting a key appends a tombstone.
+
+    Ringo cannot list keys, so keys() and do_remove() (used to clear
+    caches, not to delete sessions) need the ``key_index`` param: the keys
+    of a namespace are then tracked by appending them to an index entry when
+    they are inserted, which costs writes an extra read and put. do_remove()
+    moves on to a new generation of the index, so index entries only grow
+    with the keys inserted since the namespace was last cleared. Managers
+    look the generation up once; keys they write after another process
+    cleared the namespace may land in the previous generation.
+    """
     def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, **params):
+        self.key_index = str(params.pop('key_index', False)).lower() in ('true', '1', 'yes')
+        self.index_generation = None
         NoSqlManager.__init__(self, namespace, url=url, data_dir=data_dir, lock_dir=lock_dir, **params)
 
-    def open_connection(self, host, port):
+    def open_connection(self, host, port, **params):
         self.domain = 'default'
-        self.db_conn = Ringo("%s:%s" % (host, port))
+        connect_timeout = params.get('connect_timeout')
+        timeout = params.get('timeout')
+        self.db_conn = Ringo("%s:%s" % (host, port),
+                             max_connections=int(params.get('max_connections', 8)),
+                             connect_timeout=float(connect_timeout) if connect_timeout else None,
+                             timeout=float(timeout) if timeout else None,
+                             retries=int(params.get('retries', 0)),
+                             backoff=float(params.get('backoff', 0.1)),
+                             max_backoff=float(params.get('max_backoff', 2.0)))
+
+    def _format_key(self, key):
+        return quote(NoSqlManager._format_key(self, key), safe='')
+
+    def _format_generation_key(self):
+        return quote('beaker-generation:%s' % self.namespace, safe='')
+
+    def _format_index_key(self, generation):
+        # Namespaces written before index generations existed use the bare
+        # index key as their first generation.
+        if generation:
+            return quote('beaker-keys:%s:%s' % (self.namespace, generation), safe='')
+        return quote('beaker-keys:%s' % self.namespace, safe='')
+
+    def _generation(self):
+        if self.index_generation is None:
+            self.index_generation = self.db_conn.get_many(
+                self.domain, [self._format_generation_key()]).get(
+                    self._format_generation_key(), '')
+        return self.index_generation
+
+    def _get_single(self, key):
+        try:
+            return self.db_conn.get(self.domain, self._format_key(key), single=True)
+        except ReplyException as e:
+            if getattr(e, 'retcode', None) == 404:
+                raise KeyError(key)
+            raise
 
     def __contains__(self, key):
-        raise Exception("Unimplemented")
+        try:
+            return self._get_single(key) != TOMBSTONE
+        except KeyError:
+            return False
 
     def __getitem__(self, key):
-        return pickle.loads(self.db_conn.get(self.domain, self._format_key(key)))
+        payload = self._get_single(key)
+        if payload == TOMBSTONE:
+            raise KeyError(key)
+        return self._loads(payload)
+
+    def set_value(self, key, value, expiretime=None):
+        self.set_many([(key, value)], expiretime)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        formatted_keys = dict((self._format_key(key), key) for key in keys)
+        values = self.db_conn.get_many(self.domain, formatted_keys)
+        return dict((formatted_keys[key], self._loads(value))
+                    for key, value in values.items()
+                    if value != TOMBSTONE)
 
-    def set_value(self, key, value):
-        self.db_conn.put(self.domain, self._format_key(key), pickle.dumps(value, 2))
+    def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = [(key, self._format_key(key), value) for key, value in items]
+        if not items:
+            return
+        puts = [(formatted, self._dumps(value)) for key, formatted, value in items]
+        if self.key_index:
+            puts.extend(self._index_puts(items))
+        self.db_conn.put_many(self.domain, puts)
+
+    def _index_puts(self, items):
+        # Only index the keys not stored yet; the index generation is
+        # fetched along with them the first time.
+        lookups = [formatted for key, formatted, value in items]
+        generation_key = self._format_generation_key()
+        if self.index_generation is None:
+            lookups.append(generation_key)
+        current = self.db_conn.get_many(self.domain, lookups)
+        if self.index_generation is None:
+            self.index_generation = current.get(generation_key, '')
+        index_key = self._format_index_key(self.index_generation)
+        return [(index_key, key) for key, formatted, value in items
+                if current.get(formatted, TOMBSTONE) == TOMBSTONE]
 
     def __delitem__(self, key):
-        raise Exception("Unimplemented")
+        self.db_conn.put(self.domain, self._format_key(key), TOMBSTONE)
+
+    def delete_many(self, keys):
+        self.db_conn.put_many(self.domain,
+                              [(self._format_key(key), TOMBSTONE) for key in keys])
+
+    def _indexed_keys(self, generation):
+        try:
+            entries = self.db_conn.get(self.domain, self._format_index_key(generation))
+        except ReplyException as e:
+            if getattr(e, 'retcode', None) == 404:
+                return []
+            raise
+        seen = set()
+        return [key for key in entries if not (key in seen or seen.add(key))]
+
+    def _live_keys(self, generation):
+        if not self.key_index:
+            raise NotImplementedError("RingoManager needs the key_index param "
+                                      "to list or remove a namespace's keys")
+        keys = self._indexed_keys(generation)
+        if not keys:
+            return []
+        return list(self.get_many(keys))
 
     def do_remove(self):
-        raise Exception("Unimplemented")
+        self.index_generation = None
+        keys = self._live_keys(self._generation())
+        # Writes from now on go to a fresh, empty index.
+        self.index_generation = uuid.uuid4().hex
+        self.db_conn.put(self.domain, self._format_generation_key(), self.index_generation)
+        self.delete_many(keys)
 
     def keys(self):
-        raise Exception("Unimplemented")
+        self.index_generation = None
+        return [NoSqlManager._format_key(self, key)
+                for key in self._live_keys(self._generation())]
 
 
 class RingoContainer(Container):
@@ -1,10 +1,21 @@
-import cjson, pycurl, cStringIO, time, re
+import cjson, pycurl, cStringIO, time, re, random
 
 multi_head_re = re.compile("(\d+) (.*?) ")
 
+# pycurl errors worth retrying a request for
+RETRY_ERRORS = (pycurl.E_COULDNT_CONNECT, pycurl.E_OPERATION_TIMEOUTED,
+        pycurl.E_GOT_NOTHING, pycurl.E_RECV_ERROR, pycurl.E_SEND_ERROR)
+
 class ReplyException(Exception):
         pass
 
+class RequestException(Exception):
+        """The request failed before a reply was received, e.g. it timed
+        out; errno holds the pycurl error code."""
+        def __init__(self, errno, msg):
+                Exception.__init__(self, errno, msg)
+                self.errno = errno
+
 class DecodeRaw:
         def __init__(self):
                 self.buf = cStringIO.StringIO()
@@ -23,11 +34,16 @@ class DecodeJson:
                 self.host = host
 
 class DecodeMulti:
+        # Consumed input is only dropped from the front of the buffer once
+        # it makes up at least this many bytes and half of the buffer.
+        compact_size = 65536
+
         def __init__(self, cb = None):
                 if not cb:
                         cb = lambda e, out: out.append(e)
                 self.cb = cb
-                self.buf = ""
+                self.buf = bytearray()
+                self.pos = 0
                 self.ret = "ok"
                 self.out = []
                 self.entrylen = None
@@ -37,55 +53,75 @@ class DecodeMulti:
                 while True:
                         # State 1: Read header, if available
                         if self.entrylen == None:
-                                m = multi_head_re.match(self.buf)
+                                m = multi_head_re.match(self.buf, self.pos)
                                 if m:
-                                        sze, ret = m.groups()
+                                        sze, ret = map(str, m.groups())
                                         self.entrylen = int(sze)
                                         if ret != 'ok':
                                                 self.ret = ret
-                                        self.buf = self.buf[m.end():]
+                                        self.pos = m.end()
                                 else:
                                         # Wait for more data
                                         break
                         # State 2: Read body, if available
-                        elif len(self.buf) >= self.entrylen:
-                                r = self.cb(self.buf[:self.entrylen], self.out)
-                                self.buf = self.buf[self.entrylen:]
+                        elif len(self.buf) - self.pos >= self.entrylen:
+                                end = self.pos + self.entrylen
+                                r = self.cb(bytes(self.buf[self.pos:end]), self.out)
+                                self.pos = end
                                 self.entrylen = None
                         else:
                                 # Wait for more data
                                 break
+                if self.pos >= self.compact_size and self.pos * 2 >= len(self.buf):
+                        del self.buf[:self.pos]
+                        self.pos = 0
 
         def output(self):
-                if self.buf:
+                if len(self.buf) > self.pos:
                         raise ReplyException("%d extra bytes in the stream" %
-                                len(self.buf))
+                                (len(self.buf) - self.pos))
                 else:
                         return self.ret, self.out
 
 class Ringo:
-        def __init__(self, host, keep_alive = True):
+        def __init__(self, host, keep_alive = True, max_connections = 8,
+                        connect_timeout = None, timeout = None, retries = 0,
+                        backoff = 0.1, max_backoff = 2.0):
                 if not host.startswith("http://"):
                         host = "http://" + host
                 self.host = host
+                # Timeouts are in seconds, None meaning none. Requests
+                # timing out, failing to connect or answered with 408 or
+                # 5xx are retried up to retries times, sleeping a random
+                # time of up to backoff * 2 ** attempt (capped at
+                # max_backoff) in between.
+                self.connect_timeout = connect_timeout
+                self.timeout = timeout
+                self.retries = retries
+                self.backoff = backoff
+                self.max_backoff = max_backoff
                 if keep_alive:
                         self.curl = pycurl.Curl()
                 self.keep_alive = keep_alive
+                # Handles kept around (with their connections) by
+                # request_many()
+                self.max_connections = max_connections
+                self.multi = None
+                self.handles = []
 
-        def request(self, url, data = None, verbose = False,
-                        retries = 0, decoder = DecodeJson):
-
-                if self.keep_alive:
-                        curl = self.curl
-                else:
-                        curl = pycurl.Curl()
-
+        def _setup(self, curl, url, data, decoder):
                 if url.startswith("http://"):
                         purl = url
                 else:
                         purl = self.host + url
 
                 curl.setopt(curl.URL, purl)
+                if self.connect_timeout:
+                        curl.setopt(curl.CONNECTTIMEOUT_MS,
+                                int(self.connect_timeout * 1000))
+                if self.timeout:
+                        curl.setopt(curl.TIMEOUT_MS, int(self.timeout * 1000))
+                curl.setopt(curl.NOSIGNAL, 1)
                 if data == None:
                         curl.setopt(curl.HTTPGET, 1)
                 else:
@@ -94,24 +130,119 @@ class Ringo:
                         curl.setopt(curl.HTTPHEADER, ["Expect:"])
                 dec = decoder()
                 curl.setopt(curl.WRITEFUNCTION, dec.write)
-                try:
-                        curl.perform()
-                except pycurl.error as x:
-                        if verbose:
-                                print("Pycurl.error:", x)
-                        return x
-
-                code = curl.getinfo(curl.HTTP_CODE)
-                if verbose:
-                        print("Request took %.2fms" % (curl.getinfo(curl.TOTAL_TIME) * 1000.0))
-
-                # Request timeout
-                if code == 408 and retries > 0:
-                        time.sleep(0.1)
-                        return self.request(url, data, verbose,
-                                        retries - 1, decoder)
+                return dec
+
+        def _sleep_backoff(self, attempt):
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+
+        def request(self, url, data = None, verbose = False,
+                        retries = None, decoder = DecodeJson):
+
+                if retries == None:
+                        retries = self.retries
+
+                if self.keep_alive:
+                        curl = self.curl
                 else:
-                        return code, dec.output()
+                        curl = pycurl.Curl()
+
+                attempt = 0
+                while True:
+                        dec = self._setup(curl, url, data, decoder)
+                        try:
+                                curl.perform()
+                        except pycurl.error as x:
+                                if verbose:
+                                        print("Pycurl.error:", x)
+                                if x.args[0] in RETRY_ERRORS and attempt < retries:
+                                        self._sleep_backoff(attempt)
+                                        attempt += 1
+                                        continue
+                                raise RequestException(*x.args)
+
+                        code = curl.getinfo(curl.HTTP_CODE)
+                        if verbose:
+                                print("Request took %.2fms" % (curl.getinfo(curl.TOTAL_TIME) * 1000.0))
+
+                        # Request timeout or server error
+                        if (code == 408 or code >= 500) and attempt < retries:
+                                self._sleep_backoff(attempt)
+                                attempt += 1
+                        elif 200 <= code < 300:
+                                return code, dec.output()
+                        else:
+                                return code, None
+
+        def request_many(self, requests, verbose = False):
+                """Perform (url, data, decoder) requests concurrently.
+
+                Returns a list holding a (code, output) pair, or a
+                RequestException, for every request in order; output is
+                None unless the reply is a 2xx one. Up to max_connections
+                requests run at once; failures are not retried here.
+                """
+                if self.multi is None:
+                        self.multi = pycurl.CurlMulti()
+                multi = self.multi
+                free = self.handles
+                results = [None] * len(requests)
+                pending = list(enumerate(requests))
+                pending.reverse()
+                active = []
+                try:
+                        while pending or active:
+                                while pending and len(active) < self.max_connections:
+                                        i, (url, data, decoder) = pending.pop()
+                                        if free:
+                                                curl = free.pop()
+                                        else:
+                                                curl = pycurl.Curl()
+                                        curl.index = i
+                                        curl.dec = self._setup(curl, url, data, decoder)
+                                        multi.add_handle(curl)
+                                        active.append(curl)
+
+                                while True:
+                                        ret, num = multi.perform()
+                                        if ret != pycurl.E_CALL_MULTI_PERFORM:
+                                                break
+
+                                while True:
+                                        queued, ok_list, err_list = multi.info_read()
+                                        for curl in ok_list:
+                                                multi.remove_handle(curl)
+                                                active.remove(curl)
+                                                free.append(curl)
+                                                code = curl.getinfo(curl.HTTP_CODE)
+                                                output = None
+                                                if 200 <= code < 300:
+                                                        output = curl.dec.output()
+                                                results[curl.index] = (code, output)
+                                        for curl, errno, errmsg in err_list:
+                                                multi.remove_handle(curl)
+                                                active.remove(curl)
+                                                free.append(curl)
+                                                results[curl.index] = \
+                                                        RequestException(errno, errmsg)
+                                                if verbose:
+                                                        print("Pycurl.error:", errmsg)
+                                        if queued == 0:
+                                                break
+
+                                if active:
+                                        multi.select(1.0)
+                finally:
+                        # Leave no handle of an aborted batch attached to
+                        # the shared multi handle
+                        for curl in active:
+                                multi.remove_handle(curl)
+                                curl.close()
+
+                for curl in free:
+                        curl.dec = None
+                del free[self.max_connections:]
+                return results
 
 
         def check_reply(self, reply):
@@ -160,3 +291,60 @@ class Ringo:
                         else:
                                 kwargs['decoder'] = DecodeMulti
                         return self.check_reply(self.request(url, **kwargs))[0]
+
+        def _retryable(self, reply):
+                if isinstance(reply, RequestException):
+                        return reply.errno in RETRY_ERRORS
+                return reply[0] == 408 or reply[0] >= 500
+
+        def _retry_failed(self, requests, replies, verbose = False):
+                # Requests failing in a batch get retried one by one, with
+                # backoff, the batch counting as their first attempt
+                for i, reply in enumerate(replies):
+                        attempt = 0
+                        while self._retryable(reply) and attempt < self.retries:
+                                self._sleep_backoff(attempt)
+                                attempt += 1
+                                url, data, decoder = requests[i]
+                                try:
+                                        reply = self.request(url, data, verbose,
+                                                retries = 0, decoder = decoder)
+                                except RequestException as x:
+                                        reply = x
+                        if isinstance(reply, RequestException):
+                                raise reply
+                        replies[i] = reply
+                return replies
+
+        def put_many(self, domain, items, **kwargs):
+                """Put (key, value) pairs concurrently"""
+                requests = [("/mon/data/%s/%s" % (domain, key), value, DecodeJson)
+                                for key, value in items]
+                replies = self._retry_failed(requests,
+                        self.request_many(requests, **kwargs), **kwargs)
+                for reply in replies:
+                        self.check_reply(reply)
+
+        def get_many(self, domain, keys, **kwargs):
+                """Get the single values of keys concurrently.
+
+                Returns a dict of the values found; keys the gateway
+                answers with 404 are left out.
+                """
+                keys = list(keys)
+                requests = [("/mon/data/%s/%s?single" % (domain, key), None, DecodeRaw)
+                                for key in keys]
+                replies = self._retry_failed(requests,
+                        self.request_many(requests, **kwargs), **kwargs)
+                values = {}
+                for key, reply in zip(keys, replies):
+                        code, val = reply
+                        if code == 404:
+                                continue
+                        if code != 200:
+                                e = ReplyException("Invalid reply (code: %d)"\
+                                        % code)
+                                e.retcode = code
+                                raise e
+                        values[key] = val
+                return values
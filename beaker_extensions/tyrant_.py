@@ -1,39 +1,180 @@
 # Courtesy of: http://www.jackhsu.com/2009/05/27/pylons-with-tokyo-cabinet-beaker-sessions
 import logging
+import math
+import time
 from beaker.exceptions import InvalidCacheBackendError
 
 from beaker_extensions.nosql import Container
 from beaker_extensions.nosql import NoSqlManager
-from beaker_extensions.nosql import pickle
 
 try:
-    from pytyrant import PyTyrant
+    from pytyrant import PyTyrantPool, PooledPyTyrant, TyrantError
 except ImportError:
     raise InvalidCacheBackendError("PyTyrant cache backend requires the 'pytyrant' library")
 
 log = logging.getLogger(__name__)
 
 class TokyoTyrantManager(NoSqlManager):
+    """
+    Tokyo Tyrant backend for beaker.
+
+    Tyrant has no expiry of its own. With ``expiry = lua``, values are
+    stored along with their deadline and read through the functions of
+    tyrant_expire.lua (shipped with this package), which the server has to
+    be started with (``ttserver -ext tyrant_expire.lua``); call
+    sweep_expired() periodically to purge expired records (this needs a
+    B+tree database). Values written without a deadline never expire.
+    ``creation_lock = backend`` needs the script as well.
+
+    keys() pages through the namespace ``keys_batch_size`` keys at a time
+    with the script's list_keys() when ``expiry = lua``. Otherwise it falls
+    back to a single fwmkeys call for every key: fwmkeys cannot resume
+    after a given key, so it cannot be paged.
+    """
+
+    connection_pools = {}
+
     def __init__(self, namespace, url=None, data_dir=None, lock_dir=None, **params):
+        self.pool_size = int(params.pop('pool_size', 10))
+        self.remove_batch_size = int(params.pop('remove_batch_size', 1000))
+        self.expiry = params.pop('expiry', None)
+        self.sweep_batch_size = int(params.pop('sweep_batch_size', 1000))
+        self.keys_batch_size = int(params.pop('keys_batch_size', 1000))
         NoSqlManager.__init__(self, namespace, url=url, data_dir=data_dir, lock_dir=lock_dir, **params)
 
     def open_connection(self, host, port):
-        self.db_conn = PyTyrant.open(host, int(port))
+        pool_key = '%s:%s' % (host, port)
+        if pool_key not in self.connection_pools:
+            self.connection_pools.setdefault(
+                pool_key, PyTyrantPool(host, int(port), max_size=self.pool_size))
+        self.db_conn = PooledPyTyrant(self.connection_pools[pool_key])
+
+    def _acquire_lock(self, key, token, timeout):
+        # Checking for (expired) holders and taking the lock over has to be
+        # atomic, so it is left to tyrant_expire.lua.
+        value = '%s:%f' % (token, time.time() + timeout)
+        return self.db_conn.call_func('acquire_lock', key, value,
+                                      record_locking=True) == '1'
+
+    def _release_lock(self, key, token):
+        self.db_conn.call_func('release_lock', key, token, record_locking=True)
+
+    def _encode(self, value, expiretime=None):
+        payload = self._dumps(value)
+        if self.expiry != 'lua':
+            return payload
+        expiretime = self._item_expiretime(value, expiretime)
+        deadline = int(math.ceil(time.time() + expiretime)) if expiretime else 0
+        return '%d:' % deadline + payload
+
+    def _decode(self, stored):
+        if self.expiry == 'lua':
+            deadline, sep, payload = stored.partition(':')
+            # Values stored before expiry was enabled have no deadline.
+            if sep and deadline.isdigit():
+                if 0 < int(deadline) <= time.time():
+                    raise KeyError(deadline)
+                stored = payload
+        return self._loads(stored)
+
+    def _get_live(self, key):
+        try:
+            return self.db_conn.call_func('get_live', self._format_key(key), '',
+                                          record_locking=True)
+        except TyrantError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        if self.expiry == 'lua':
+            return self._decode(self._get_live(key))
+        return NoSqlManager.__getitem__(self, key)
 
     def __contains__(self, key):
+        if self.expiry == 'lua':
+            try:
+                self._get_live(key)
+            except KeyError:
+                return False
+            return True
         return self.db_conn.has_key(self._format_key(key))
 
-    def set_value(self, key, value):
-        self.db_conn[self._format_key(key)] =  pickle.dumps(value, 2)
+    def set_value(self, key, value, expiretime=None):
+        self.db_conn[self._format_key(key)] = self._encode(value, expiretime)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        payloads = self.db_conn.multi_get([self._format_key(key) for key in keys])
+        result = {}
+        for key, payload in zip(keys, payloads):
+            if payload is not None:
+                try:
+                    result[key] = self._decode(payload)
+                except KeyError:
+                    pass
+        return result
+
+    def set_many(self, items, expiretime=None):
+        if hasattr(items, 'items'):
+            items = items.items()
+        self.db_conn.multi_set([(self._format_key(key), self._encode(value, expiretime))
+                                for key, value in items])
+
+    def delete_many(self, keys):
+        keys = [self._format_key(key) for key in keys]
+        if keys:
+            self.db_conn.multi_del(keys)
 
     def __delitem__(self, key):
         del self.db_conn[self._format_key(key)]
 
+    def _format_prefix(self):
+        return self._format_key('')
+
     def do_remove(self):
-        self.db_conn.clear()
+        # Delete the namespace's keys page by page; removed keys drop out of
+        # the prefix scan, so every page starts from the front again.
+        prefix = self._format_prefix()
+        while True:
+            keys = self.db_conn.prefix_keys(prefix, self.remove_batch_size)
+            if not keys:
+                break
+            self.db_conn.multi_del(keys)
+
+    def sweep_expired(self, batch_size=None):
+        """Remove the namespace's expired records, checking batch_size
+        (default: the sweep_batch_size param) records per round-trip.
+        Returns the number of records removed.
+        """
+        prefix = self._format_prefix()
+        batch_size = batch_size or self.sweep_batch_size
+        removed = 0
+        cursor = ''
+        while True:
+            reply = self.db_conn.call_func('sweep', prefix, '%d:%s' % (batch_size, cursor),
+                                           global_locking=True)
+            count, cursor = reply.split(':', 1)
+            removed += int(count)
+            if not cursor:
+                return removed
 
     def keys(self):
-        return self.db_conn.keys()
+        prefix = self._format_prefix()
+        if self.expiry != 'lua':
+            # A negative maxkeys asks fwmkeys for every match in one round-trip.
+            return self.db_conn.prefix_keys(prefix, -1)
+        keys = []
+        cursor = ''
+        while True:
+            reply = self.db_conn.call_func('list_keys', prefix,
+                                           '%d:%s' % (self.keys_batch_size, cursor),
+                                           global_locking=True)
+            page = reply.split('\0')
+            cursor = page[0]
+            keys.extend(page[1:])
+            if not cursor:
+                return keys
 
 
 class TokyoTyrantContainer(Container):
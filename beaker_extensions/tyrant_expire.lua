@@ -0,0 +1,120 @@
+-- Server side expiry for beaker_extensions' Tokyo Tyrant backend.
+--
+-- Load it into the server with:
+--
+--     ttserver -ext /path/to/beaker_extensions/tyrant_expire.lua ...
+--
+-- With the backend's expiry param set to "lua", values are stored as
+-- "<deadline>:<payload>", deadline being a unix time (0 for never). The
+-- backend's creation_lock = backend mode relies on acquire_lock and
+-- release_lock whatever the expiry param.
+
+local function deadline(value)
+   local sep = string.find(value, ":", 1, true)
+   if not sep then
+      return nil
+   end
+   return tonumber(string.sub(value, 1, sep - 1))
+end
+
+local function expired(value, now)
+   local d = deadline(value)
+   return d ~= nil and d > 0 and d <= now
+end
+
+-- get_live(key): the stored value, or failure when it is missing or expired.
+-- Expired records are removed on the way.
+function get_live(key, value)
+   local stored = _get(key)
+   if not stored then
+      return nil
+   end
+   if expired(stored, _time()) then
+      _out(key)
+      return nil
+   end
+   return stored
+end
+
+-- scan(prefix, "<limit>:<cursor>"): up to limit keys starting with prefix,
+-- from key cursor on (from prefix when empty), and the key to resume from,
+-- empty once every key of the prefix was seen.
+--
+-- The scan resumes from a key rather than a position, so it needs a B+tree
+-- database (keys in order) and must run under the global lock, the
+-- iterator being shared by every thread of the server.
+local function scan(prefix, value)
+   local sep = string.find(value, ":", 1, true)
+   local limit = tonumber(string.sub(value, 1, sep - 1))
+   local cursor = string.sub(value, sep + 1)
+   if cursor == "" then
+      cursor = prefix
+   end
+   local keys = {}
+   if not _iterinit(cursor) then
+      return keys, ""
+   end
+   while true do
+      local key = _iternext()
+      if not key or string.sub(key, 1, #prefix) ~= prefix then
+         break
+      end
+      if #keys >= limit then
+         return keys, key
+      end
+      keys[#keys + 1] = key
+   end
+   return keys, ""
+end
+
+-- sweep(prefix, "<limit>:<cursor>"): check a page of scan() and remove its
+-- expired records. Returns "<removed>:<next cursor>".
+function sweep(prefix, value)
+   local keys, next_cursor = scan(prefix, value)
+   local now = _time()
+   local removed = 0
+   for i = 1, #keys do
+      local stored = _get(keys[i])
+      if stored and expired(stored, now) then
+         _out(keys[i])
+         removed = removed + 1
+      end
+   end
+   return removed .. ":" .. next_cursor
+end
+
+-- list_keys(prefix, "<limit>:<cursor>"): a page of scan() as the next cursor
+-- followed by the keys, all separated by NUL bytes.
+function list_keys(prefix, value)
+   local keys, next_cursor = scan(prefix, value)
+   table.insert(keys, 1, next_cursor)
+   return table.concat(keys, "\0")
+end
+
+local function lock_holder(value)
+   return string.match(value, "^(.*):([^:]*)$")
+end
+
+-- acquire_lock(key, "<token>:<deadline>"): store the lock unless another
+-- holder's lock has not reached its deadline yet. Returns "1" when the lock
+-- was taken, "0" otherwise. Meant to run under the record lock.
+function acquire_lock(key, value)
+   local held = _get(key)
+   if held then
+      local holder, held_until = lock_holder(held)
+      if tonumber(held_until) and tonumber(held_until) >= _time() then
+         return "0"
+      end
+   end
+   _put(key, value)
+   return "1"
+end
+
+-- release_lock(key, token): remove the lock if it is still held with token.
+function release_lock(key, token)
+   local held = _get(key)
+   if held and lock_holder(held) == token then
+      _out(key)
+   end
+   return ""
+end
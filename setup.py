@@ -16,6 +16,7 @@ setup(name='beaker_extensions',
       license='',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
+      package_data={'beaker_extensions': ['*.lua']},
       zip_safe=False,
       install_requires=[
           # -*- Extra requirements: -*-
@@ -0,0 +1,305 @@
+"""In-memory stand-ins for the backend clients used by the tests."""
+import re
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+def _glob_to_regex(pattern):
+    # Redis glob patterns: *, ?, [...] and backslash escapes.
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        elif c == '*':
+            regex.append('.*')
+        elif c == '?':
+            regex.append('.')
+        elif c == '[':
+            end = pattern.index(']', i)
+            regex.append(pattern[i:end + 1])
+            i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(regex) + r'\Z', re.S)
+
+
+class FakeRedis(object):
+    """
+    Dict backed StrictRedis replacement. Clients built on connection pools
+    with the same host, port and db share their data through ``servers``.
+    """
+    servers = {}
+    subscriptions = {}
+
+    def __init__(self, connection_pool=None, **params):
+        kwargs = connection_pool.connection_kwargs if connection_pool else {}
+        self.address = (kwargs.get('host'), kwargs.get('port'), kwargs.get('db'))
+        self.data = self.servers.setdefault(self.address, {})
+        self.published = []
+        self.calls = []
+
+    @classmethod
+    def reset(cls):
+        cls.servers.clear()
+        cls.subscriptions.clear()
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            entry = None
+        return entry
+
+    def get(self, key):
+        self.calls.append(('get', key))
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    def mget(self, keys):
+        self.calls.append(('mget', tuple(keys)))
+        return [self.get(key) for key in keys]
+
+    def exists(self, key):
+        return int(self._live(key) is not None)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self._live(key) is not None:
+            return None
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        self.data[key] = (value, time.time() + px / 1000.0 if px else None)
+        return True
+
+    def setex(self, key, seconds, value):
+        self.data[key] = (value, time.time() + seconds)
+        return True
+
+    def ttl(self, key):
+        entry = self._live(key)
+        if entry is None:
+            return -2
+        if entry[1] is None:
+            return -1
+        return int(round(entry[1] - time.time()))
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    unlink = delete
+
+    def scan_iter(self, match=None, count=None):
+        regex = _glob_to_regex(match or '*')
+        return iter([key for key in list(self.data)
+                     if regex.match(key) and self._live(key) is not None])
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        queues = self.subscriptions.get((self.address, channel), [])
+        for queue in queues:
+            queue.put(message)
+        return len(queues)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def eval(self, script, numkeys, key, token):
+        # Only knows the creation lock release script: compare and delete.
+        entry = self._live(key)
+        if entry is not None and entry[0] == token.encode('utf-8'):
+            return self.delete(key)
+        return 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePubSub(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.queue = Queue()
+
+    def subscribe(self, channel):
+        FakeRedis.subscriptions.setdefault((self.client.address, channel), []).append(self.queue)
+
+    def listen(self):
+        while True:
+            yield {'type': 'message', 'data': self.queue.get()}
+
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.client, name)(*args, **kwargs)
+                for name, args, kwargs in commands]
+
+
+def use_fake_redis(testcase):
+    """Make RedisManager connect to FakeRedis for the duration of a test,
+    with empty connection, ring and local cache registries."""
+    from beaker_extensions import redis_
+    from beaker_extensions.nosql import NoSqlManager
+
+    registries = (redis_.RedisManager.connection_pools, redis_.RedisManager.hash_rings,
+                  redis_.RedisManager.invalidation_subscribers, NoSqlManager.local_caches)
+    original = redis_.StrictRedis
+
+    def restore():
+        redis_.StrictRedis = original
+        for registry in registries:
+            registry.clear()
+        FakeRedis.reset()
+
+    restore()
+    redis_.StrictRedis = FakeRedis
+    testcase.addCleanup(restore)
+
+
+class FakeRingo(object):
+    """
+    Append-only in-memory stand-in for ringogw.Ringo; ``calls`` logs every
+    round trip as (method, keys).
+    """
+    entries = {}
+    reply_exception = Exception
+
+    def __init__(self, host, **params):
+        self.calls = []
+
+    @classmethod
+    def reset(cls):
+        cls.entries.clear()
+
+    def _missing(self):
+        e = self.reply_exception("Invalid reply (code: 404)")
+        e.retcode = 404
+        return e
+
+    def put(self, domain, key, value):
+        self.calls.append(('put', [key]))
+        self.entries.setdefault((domain, key), []).append(value)
+
+    def put_many(self, domain, items):
+        items = list(items)
+        self.calls.append(('put_many', [key for key, value in items]))
+        for key, value in items:
+            self.entries.setdefault((domain, key), []).append(value)
+
+    def get(self, domain, key, single=False):
+        self.calls.append(('get', [key]))
+        if (domain, key) not in self.entries:
+            raise self._missing()
+        values = self.entries[(domain, key)]
+        return values[-1] if single else list(values)
+
+    def get_many(self, domain, keys):
+        keys = list(keys)
+        self.calls.append(('get_many', keys))
+        return dict((key, self.entries[(domain, key)][-1])
+                    for key in keys if (domain, key) in self.entries)
+
+
+class FakeTyrant(object):
+    """
+    Dict backed stand-in for a PooledPyTyrant on a B+tree database loaded
+    with tyrant_expire.lua; ``calls`` logs the methods called.
+    """
+    tyrant_error = Exception
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def _deadline(self, value):
+        deadline, sep, payload = value.partition(':')
+        return int(deadline) if sep and deadline.isdigit() else None
+
+    def _expired(self, value):
+        deadline = self._deadline(value)
+        return bool(deadline) and deadline <= time.time()
+
+    def _scan(self, prefix, cursor, limit):
+        keys = sorted(key for key in self.data
+                      if key.startswith(prefix) and key >= (cursor or prefix))
+        if len(keys) > limit:
+            return keys[:limit], keys[limit]
+        return keys, ''
+
+    def __getitem__(self, key):
+        self.calls.append('get')
+        return self.data[key]
+
+    def get(self, key, default=None):
+        self.calls.append('get')
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.calls.append('put')
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.calls.append('out')
+        del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    has_key = __contains__
+
+    def multi_get(self, keys):
+        self.calls.append('getlist')
+        return [self.data.get(key) for key in keys]
+
+    def multi_set(self, items):
+        self.calls.append('putlist')
+        self.data.update(items)
+
+    def multi_del(self, keys):
+        self.calls.append('outlist')
+        for key in keys:
+            self.data.pop(key, None)
+
+    def prefix_keys(self, prefix, maxkeys=None):
+        self.calls.append('fwmkeys')
+        keys = sorted(key for key in self.data if key.startswith(prefix))
+        return keys if maxkeys is None or maxkeys < 0 else keys[:maxkeys]
+
+    def call_func(self, func, key, value, record_locking=False, global_locking=False):
+        self.calls.append(func)
+        if func == 'get_live':
+            stored = self.data.get(key)
+            if stored is None or self._expired(stored):
+                self.data.pop(key, None)
+                raise self.tyrant_error(1)
+            return stored
+        if func == 'sweep':
+            limit, cursor = value.split(':', 1)
+            keys, cursor = self._scan(key, cursor, int(limit))
+            expired = [k for k in keys if self._expired(self.data[k])]
+            for k in expired:
+                del self.data[k]
+            return '%d:%s' % (len(expired), cursor)
+        if func == 'list_keys':
+            limit, cursor = value.split(':', 1)
+            keys, cursor = self._scan(key, cursor, int(limit))
+            return '\0'.join([cursor] + keys)
+        raise self.tyrant_error(1)
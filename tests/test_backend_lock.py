@@ -0,0 +1,57 @@
+import unittest
+
+try:
+    from beaker.exceptions import InvalidCacheBackendError
+    from beaker_extensions.nosql import BackendLock, NoSqlManager
+    from beaker_extensions.redis_ import RedisManager
+except ImportError:
+    RedisManager = None
+
+from fakes import use_fake_redis
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class BackendLockTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    def manager(self, **params):
+        return RedisManager('ns', url='h1:1', creation_lock='backend', **params)
+
+    def test_lock_is_shared_through_the_backend(self):
+        first, second = self.manager(), self.manager()
+        lock = first.get_creation_lock('k')
+        self.assertTrue(isinstance(lock, BackendLock))
+        self.assertTrue(lock.acquire(wait=False))
+        other = second.get_creation_lock('k')
+        self.assertFalse(other.acquire(wait=False))
+        lock.release()
+        self.assertTrue(other.acquire(wait=False))
+
+    def test_lock_expires(self):
+        manager = self.manager(lock_timeout=5)
+        lock = manager.get_creation_lock('k')
+        lock.acquire()
+        self.assertTrue(0 < manager.db_conn.ttl(lock.key) <= 5)
+
+    def test_release_leaves_other_holders_alone(self):
+        manager = self.manager()
+        lock = manager.get_creation_lock('k')
+        lock.acquire()
+        # The lock expired and was taken over meanwhile.
+        manager.db_conn.set(lock.key, 'other token')
+        lock.release()
+        self.assertEqual(manager.db_conn.get(lock.key), b'other token')
+
+    def test_lock_keys_stay_out_of_the_namespace(self):
+        manager = self.manager()
+        manager.get_creation_lock('k').acquire()
+        self.assertEqual(list(manager.keys()), [])
+
+    def test_invalid_settings(self):
+        self.assertRaises(InvalidCacheBackendError, RedisManager, 'ns', url='h1:1',
+                          creation_lock='redis')
+        self.assertRaises(InvalidCacheBackendError, NoSqlManager, 'ns', url='h1:1',
+                          creation_lock='backend')
+        NoSqlManager('ns', url='h1:1', creation_lock='file')
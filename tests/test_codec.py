@@ -0,0 +1,57 @@
+import json
+import pickle
+import struct
+import unittest
+
+from beaker_extensions.nosql import Codec
+
+
+class CodecTest(unittest.TestCase):
+
+    value = (1234567890.5, 300, {'user': 'alice', 'items': [1, 2, 3]})
+
+    def test_round_trip(self):
+        for serializer in ('pickle', 'json'):
+            codec = Codec(serializer)
+            payload = codec.dumps(self.value)
+            self.assertTrue(ord(payload[:1]) < Codec.HEADER_LIMIT)
+            loaded = codec.loads(payload)
+            if serializer == 'json':
+                loaded = tuple(loaded)
+            self.assertEqual(loaded, self.value)
+
+    def test_header_byte(self):
+        self.assertEqual(Codec('pickle').dumps('x')[:1], struct.pack('B', 1))
+        self.assertEqual(Codec('json').dumps('x')[:1], struct.pack('B', 2))
+        codec = Codec('json', 'zlib', threshold=10)
+        self.assertEqual(codec.dumps('x' * 100)[:1], struct.pack('B', 2 | 1 << 3))
+
+    def test_compression_threshold(self):
+        codec = Codec('pickle', 'zlib', threshold=100)
+        small = codec.dumps('x' * 10)
+        large = codec.dumps('x' * 1000)
+        self.assertEqual(ord(small[:1]) >> 3, 0)
+        self.assertEqual(ord(large[:1]) >> 3, 1)
+        self.assertTrue(len(large) < 1000)
+        self.assertEqual(codec.loads(small), 'x' * 10)
+        self.assertEqual(codec.loads(large), 'x' * 1000)
+
+    def test_header_decides_decoding(self):
+        # Values stay readable after the serializer or compression changed.
+        payload = Codec('json', 'zlib', threshold=0).dumps([1, 2])
+        self.assertEqual(Codec('pickle').loads(payload), [1, 2])
+
+    def test_legacy_pickle_payloads(self):
+        codec = Codec('pickle')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            payload = pickle.dumps(self.value, protocol)
+            self.assertEqual(codec.loads(payload), self.value)
+
+    def test_legacy_json_payloads(self):
+        codec = Codec('json')
+        for value in ({'a': 1}, [1, 2], 'text', 12, None):
+            self.assertEqual(codec.loads(json.dumps(value)), value)
+            self.assertEqual(codec.loads(json.dumps(value).encode('utf-8')), value)
+
+    def test_unknown_header(self):
+        self.assertRaises(ValueError, Codec('pickle').loads, struct.pack('B', 7) + b'x')
@@ -0,0 +1,70 @@
+import unittest
+
+try:
+    from beaker_extensions.redis_ import HashRing, RedisManager
+except ImportError:
+    HashRing = None
+
+from fakes import use_fake_redis
+
+
+KEYS = ['beaker:ns:key%d' % i for i in range(5000)]
+
+
+@unittest.skipIf(HashRing is None, "HashRing requires the 'redis' library")
+class HashRingTest(unittest.TestCase):
+
+    def test_stable_mapping(self):
+        nodes = [('a:6379', 1), ('b:6379', 1), ('c:6379', 1)]
+        ring, other = HashRing(nodes), HashRing(list(reversed(nodes)))
+        for key in KEYS[:100]:
+            self.assertEqual(ring.get_node(key), other.get_node(key))
+
+    def test_weights(self):
+        ring = HashRing([('a:6379', 2), ('b:6379', 1)])
+        counts = {}
+        for key in KEYS:
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+        share = counts['a:6379'] / float(len(KEYS))
+        self.assertTrue(0.55 < share < 0.78, share)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        ring = HashRing([('a:6379', 1), ('b:6379', 1), ('c:6379', 1)])
+        smaller = HashRing([('a:6379', 1), ('b:6379', 1)])
+        for key in KEYS:
+            node = ring.get_node(key)
+            if node != 'c:6379':
+                self.assertEqual(smaller.get_node(key), node)
+
+
+@unittest.skipIf(HashRing is None, "RedisManager requires the 'redis' library")
+class RingModeTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.manager = RedisManager('ns', url='h1:1,h2:2,h3:3')
+
+    def test_keys_are_read_from_their_node(self):
+        for i in range(20):
+            self.manager.set_value('key%d' % i, i)
+        nodes = set()
+        for i in range(20):
+            key = self.manager._format_key('key%d' % i)
+            conn = self.manager._conn_for(key)
+            nodes.add(conn.address)
+            self.assertEqual(conn.get(key) is not None, True)
+            self.assertTrue('key%d' % i in self.manager)
+            self.assertEqual(self.manager['key%d' % i], i)
+        self.assertEqual(len(nodes), 3)
+
+    def test_missing_key(self):
+        self.assertRaises(KeyError, lambda: self.manager['missing'])
+
+    def test_bulk_operations_span_nodes(self):
+        values = dict(('key%d' % i, i) for i in range(20))
+        self.manager.set_many(values)
+        self.assertEqual(self.manager.get_many(list(values) + ['missing']), values)
+        self.manager.delete_many(list(values)[:10])
+        self.assertEqual(len(self.manager.get_many(values)), 10)
+        self.assertEqual(len(self.manager.keys()), 10)
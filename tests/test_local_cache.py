@@ -0,0 +1,174 @@
+import time
+import unittest
+
+try:
+    from beaker_extensions.nosql import LocalCache, LocalCacheMixin
+    from beaker_extensions.redis_ import RedisManager
+except ImportError:
+    RedisManager = None
+
+from fakes import use_fake_redis
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class LocalCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = LocalCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertRaises(KeyError, cache.get, 'b')
+
+    def test_deadline_and_ttl(self):
+        cache = LocalCache(10, ttl=60)
+        cache.set('past', 1, deadline=time.time() - 1)
+        self.assertRaises(KeyError, cache.get, 'past')
+        cache.set('ttl', 1, deadline=time.time() + 3600)
+        self.assertTrue(cache._entries['ttl'][0] <= time.time() + 60)
+
+    def test_fills_racing_invalidations_are_dropped(self):
+        cache = LocalCache(10)
+        version = cache.version('a')
+        cache.discard('a')
+        cache.set('a', 'stale', version=version)
+        self.assertRaises(KeyError, cache.get, 'a')
+
+        version = cache.version('a')
+        cache.clear()
+        cache.set('a', 'stale', version=version)
+        self.assertRaises(KeyError, cache.get, 'a')
+
+    def test_unrelated_invalidations_do_not_drop_fills(self):
+        cache = LocalCache(10)
+        others = [key for key in ('k%d' % i for i in range(100))
+                  if cache._stripe(key) != cache._stripe('a')]
+        version = cache.version('a')
+        for key in others:
+            cache.discard(key)
+        cache.set('a', 'fresh', version=version)
+        self.assertEqual(cache.get('a'), 'fresh')
+
+    def test_discard_and_clear(self):
+        cache = LocalCache(10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.discard('a')
+        self.assertRaises(KeyError, cache.get, 'a')
+        cache.clear()
+        self.assertRaises(KeyError, cache.get, 'b')
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class LocalCacheTierTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    def manager(self, url='h1:1?l1_size=10', **params):
+        return RedisManager('ns', url=url, **params)
+
+    def test_tier_is_optional(self):
+        self.assertFalse(isinstance(RedisManager('ns', url='h1:1'), LocalCacheMixin))
+        self.assertTrue(isinstance(self.manager(), LocalCacheMixin))
+        self.assertTrue(isinstance(self.manager(url='h1:1', l1_size=10), LocalCacheMixin))
+
+    def test_reads_are_served_locally(self):
+        manager = self.manager()
+        manager.set_value('a', 'x')
+        self.assertEqual(manager['a'], 'x')
+        manager.db_conn.calls[:] = []
+        self.assertEqual(manager['a'], 'x')
+        self.assertEqual(manager.get_many(['a']), {'a': 'x'})
+        self.assertEqual(manager.db_conn.calls, [])
+
+    def test_local_writes_invalidate(self):
+        manager, other = self.manager(), self.manager()
+        self.assertTrue(manager.local_cache is other.local_cache)
+        manager.set_value('a', 'x')
+        self.assertEqual(other['a'], 'x')
+        manager.set_value('a', 'y')
+        self.assertEqual(other['a'], 'y')
+        del manager['a']
+        self.assertRaises(KeyError, lambda: other['a'])
+        manager.set_many({'a': 1, 'b': 2})
+        self.assertEqual(other.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        manager.do_remove()
+        self.assertEqual(other.get_many(['a', 'b']), {})
+
+    def test_stores_do_not_share_entries(self):
+        db1 = self.manager(db=1)
+        db2 = self.manager(db=2)
+        db1.set_value('a', 'one')
+        db2.set_value('a', 'two')
+        self.assertEqual(db1['a'], 'one')
+        self.assertEqual(db2['a'], 'two')
+
+    def test_params_given_twice(self):
+        manager = self.manager(url='h1:1?l1_size=5&l1_ttl=2', l1_size=10, l1_ttl=1)
+        self.assertEqual((manager.local_cache.size, manager.local_cache.ttl), (10, 1))
+
+    def test_invalidation_during_backend_read(self):
+        manager = self.manager()
+        manager.set_value('a', 'old')
+        read = manager.db_conn.get
+
+        def racing_get(key):
+            value = read(key)
+            manager.db_conn.set(key, manager._dumps('new'))
+            manager.local_cache.discard(key)
+            return value
+        manager.db_conn.get = racing_get
+        self.assertEqual(manager['a'], 'old')
+        del manager.db_conn.get
+        self.assertEqual(manager['a'], 'new')
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class InvalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        # Different l1 settings give each manager a cache of its own, like
+        # managers of different processes.
+        self.writer = RedisManager('ns', url='h1:1', l1_size=10, l1_ttl=100,
+                                   invalidation_channel='inv')
+        self.reader = RedisManager('ns', url='h1:1', l1_size=10, l1_ttl=200,
+                                   invalidation_channel='inv')
+        # Subscribers clear their cache once subscribed.
+        self.wait_for(lambda: self.writer.local_cache._cleared and self.reader.local_cache._cleared)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition():
+            if time.time() > deadline:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def cached(self, key):
+        try:
+            self.reader.local_cache.get(self.reader._format_key(key))
+        except KeyError:
+            return False
+        return True
+
+    def test_writes_are_published(self):
+        self.writer.set_value('a', 1)
+        self.writer.delete_many(['a'])
+        self.writer.do_remove()
+        self.assertEqual(self.writer.db_conn.published,
+                         [('inv', 'beaker:ns:a')] * 2 + [('inv', '*')])
+
+    def test_other_caches_are_invalidated(self):
+        # Stored behind the managers' backs, so nothing is published yet.
+        for key, value in (('a', 1), ('b', 2)):
+            self.writer.db_conn.set(self.writer._format_key(key), self.writer._dumps(value))
+        self.assertEqual((self.reader['a'], self.reader['b']), (1, 2))
+        self.writer.set_value('a', 3)
+        self.wait_for(lambda: not self.cached('a'))
+        self.assertEqual(self.reader['a'], 3)
+        self.assertTrue(self.cached('b'))
+        self.writer.do_remove()
+        self.wait_for(lambda: not self.cached('b'))
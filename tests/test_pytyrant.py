@@ -0,0 +1,131 @@
+import struct
+import unittest
+
+try:
+    from beaker_extensions.pytyrant import BufferedSocket, Tyrant, TyrantError, TyrantConnectionError
+    from beaker_extensions.pytyrant import PyTyrantPool
+except ImportError:
+    # pytyrant only runs on Python 2.
+    BufferedSocket = None
+
+
+class ChunkedSocket(object):
+    """Socket stub receiving the given chunks, one per recv_into call."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def recv_into(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        n = min(len(view), len(chunk))
+        view[:n] = chunk[:n]
+        if n < len(chunk):
+            self.chunks.insert(0, chunk[n:])
+        return n
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@unittest.skipIf(BufferedSocket is None, "pytyrant requires Python 2")
+class BufferedSocketTest(unittest.TestCase):
+
+    def test_fields_spanning_chunks(self):
+        data = b'\x00' + struct.pack('>I', 5) + b'hello' + struct.pack('>I', 2) + b'ok'
+        sock = BufferedSocket(ChunkedSocket(split(data, 3)), bufsize=16)
+        self.assertEqual(sock.read(1), b'\x00')
+        self.assertEqual(struct.unpack('>I', sock.read(4))[0], 5)
+        self.assertEqual(sock.read(5), b'hello')
+        self.assertEqual(struct.unpack('>I', sock.read(4))[0], 2)
+        self.assertEqual(sock.read(2), b'ok')
+
+    def test_reads_larger_than_buffer(self):
+        value = bytes(bytearray(range(256))) * 4
+        data = b'abc' + value + b'xyz'
+        sock = BufferedSocket(ChunkedSocket(split(data, 7)), bufsize=8)
+        self.assertEqual(sock.read(3), b'abc')
+        self.assertEqual(sock.read(len(value)), value)
+        self.assertEqual(sock.read(3), b'xyz')
+
+    def test_buffer_compaction(self):
+        data = bytes(bytearray(range(100)))
+        sock = BufferedSocket(ChunkedSocket(split(data, 5)), bufsize=8)
+        self.assertEqual(b''.join(sock.read(3) for i in range(33)), data[:99])
+
+    def test_connection_closed(self):
+        sock = BufferedSocket(ChunkedSocket([b'ab']), bufsize=8)
+        self.assertRaises(TyrantConnectionError, sock.read, 4)
+
+
+@unittest.skipIf(BufferedSocket is None, "pytyrant requires Python 2")
+class TyrantPipelineTest(unittest.TestCase):
+
+    def test_replies_in_order(self):
+        replies = b'\x00' + b'\x00' + struct.pack('>I', 1) + b'1' + b'\x01'
+        sock = ChunkedSocket(split(replies, 2))
+        pipe = Tyrant(sock).pipeline()
+        pipe.put('a', '1')
+        pipe.get('a')
+        pipe.get('missing')
+        results = pipe.execute()
+        self.assertEqual(len(sock.sent), 1)
+        self.assertEqual(results[:2], [None, '1'])
+        self.assertTrue(isinstance(results[2], TyrantError))
+        self.assertEqual(len(pipe), 0)
+
+
+class FakeConnection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(BufferedSocket is None, "pytyrant requires Python 2")
+class PyTyrantPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = PyTyrantPool(max_size=2)
+        self.pool._connect = FakeConnection
+
+    def failing(self, error):
+        def func(conn):
+            self.conn = conn
+            raise error
+        return func
+
+    def test_connections_are_reused(self):
+        first = self.pool.run(lambda conn: conn)
+        self.assertTrue(self.pool.run(lambda conn: conn) is first)
+        self.assertEqual(self.pool.size, 1)
+
+    def test_server_errors_keep_the_connection(self):
+        for error in (TyrantError(1), KeyError('a')):
+            self.assertRaises(type(error), self.pool.run, self.failing(error))
+            self.assertFalse(self.conn.closed)
+            self.assertEqual(len(self.pool.idle), 1)
+
+    def test_other_errors_discard_the_connection(self):
+        for error in (ValueError(), KeyboardInterrupt()):
+            self.assertRaises(type(error), self.pool.run, self.failing(error))
+            self.assertTrue(self.conn.closed)
+            self.assertEqual((self.pool.size, len(self.pool.idle)), (0, 0))
+
+    def test_broken_connections_are_retried_once(self):
+        calls = []
+
+        def func(conn):
+            calls.append(conn)
+            if len(calls) == 1:
+                raise TyrantConnectionError("closed")
+            return 'ok'
+        self.assertEqual(self.pool.run(func), 'ok')
+        self.assertTrue(calls[0].closed)
+        self.assertEqual(self.pool.size, 1)
@@ -0,0 +1,77 @@
+import unittest
+
+try:
+    from beaker_extensions.redis_ import RedisManager
+except ImportError:
+    RedisManager = None
+
+from fakes import use_fake_redis
+
+
+@unittest.skipIf(RedisManager is None, "RedisManager requires the 'redis' library")
+class KeysTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    def test_keys_are_scoped_to_the_namespace(self):
+        manager = RedisManager('ns', url='h1:1')
+        other = RedisManager('ns2', url='h1:1')
+        manager.set_many({'a': 1, 'b': 2})
+        other.set_value('a', 1)
+        self.assertEqual(sorted(manager.keys()), ['beaker:ns:a', 'beaker:ns:b'])
+        self.assertEqual(other.keys(), ['beaker:ns2:a'])
+
+    def test_glob_characters_in_namespaces(self):
+        for namespace in ('n*', 'n?', 'n[s]', 'ns', 'n\\s'):
+            RedisManager(namespace, url='h1:1').set_value('a', namespace)
+        for namespace in ('n*', 'n?', 'n[s]', 'n\\s'):
+            manager = RedisManager(namespace, url='h1:1')
+            self.assertEqual(manager.keys(), [manager._format_key('a')])
+
+    def test_scan_count(self):
+        manager = RedisManager('ns', url='h1:1', scan_count=10)
+        counts = []
+
+        def scan_iter(match=None, count=None):
+            counts.append(count)
+            return iter([])
+        manager.db_conn.scan_iter = scan_iter
+        manager.keys()
+        list(manager.iterkeys(count=50))
+        self.assertEqual(counts, [10, 50])
+
+
+@unittest.skipIf(RedisManager is None, "RedisManager requires the 'redis' library")
+class RemoveTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    def test_other_namespaces_are_left_alone(self):
+        manager = RedisManager('ns', url='h1:1')
+        other = RedisManager('ns2', url='h1:1')
+        glob = RedisManager('n*', url='h1:1')
+        manager.set_many(dict(('key%d' % i, i) for i in range(10)))
+        other.set_value('a', 1)
+        glob.set_value('a', 1)
+        glob.do_remove()
+        self.assertEqual(len(manager.keys()), 10)
+        manager.do_remove()
+        self.assertEqual(manager.keys(), [])
+        self.assertEqual(other['a'], 1)
+        self.assertEqual(glob.keys(), [])
+
+    def test_keys_are_unlinked_in_batches(self):
+        manager = RedisManager('ns', url='h1:1', remove_batch_size=4)
+        manager.set_many(dict(('key%d' % i, i) for i in range(10)))
+        batches = []
+        unlink = manager.db_conn.unlink
+
+        def recording_unlink(*keys):
+            batches.append(len(keys))
+            return unlink(*keys)
+        manager.db_conn.unlink = recording_unlink
+        manager.do_remove()
+        self.assertEqual(batches, [4, 4, 2])
+        self.assertEqual(manager.keys(), [])
@@ -0,0 +1,89 @@
+import unittest
+
+try:
+    from beaker_extensions import ringo
+except ImportError:
+    # ringogw only runs on Python 2, with cjson and pycurl.
+    ringo = None
+
+from fakes import FakeRingo
+
+
+@unittest.skipIf(ringo is None, "RingoManager requires the 'ringogw' library")
+class RingoManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        original = ringo.Ringo
+        ringo.Ringo = FakeRingo
+        FakeRingo.reply_exception = ringo.ReplyException
+        FakeRingo.reset()
+
+        def restore():
+            ringo.Ringo = original
+        self.addCleanup(restore)
+
+    def manager(self, **params):
+        return ringo.RingoManager('ns', url='ringo:15000', **params)
+
+    def test_deletes_write_tombstones(self):
+        manager = self.manager()
+        manager.set_value('a', 1)
+        manager.set_value('b', 2)
+        self.assertTrue('a' in manager)
+        self.assertEqual(manager['a'], 1)
+        del manager['a']
+        manager.delete_many(['b'])
+        self.assertEqual(FakeRingo.entries[('default', manager._format_key('a'))][-1],
+                         ringo.TOMBSTONE)
+        self.assertFalse('a' in manager)
+        self.assertFalse('missing' in manager)
+        self.assertRaises(KeyError, lambda: manager['a'])
+        self.assertRaises(KeyError, lambda: manager['missing'])
+        self.assertEqual(manager.get_many(['a', 'b']), {})
+        manager.set_value('a', 3)
+        self.assertEqual(manager.get_many(['a', 'b']), {'a': 3})
+
+    def test_writes_take_one_round_trip(self):
+        manager = self.manager()
+        manager.set_value('a', 1)
+        manager.set_many({'b': 2, 'c': 3})
+        self.assertEqual([method for method, keys in manager.db_conn.calls],
+                         ['put_many', 'put_many'])
+        self.assertRaises(NotImplementedError, manager.keys)
+        self.assertRaises(NotImplementedError, manager.do_remove)
+
+    def test_key_index(self):
+        manager = self.manager(key_index=True)
+        manager.set_value('a', 1)
+        manager.set_value('a', 2)
+        manager.set_many({'b': 1, 'c': 1})
+        del manager['c']
+        self.assertEqual(sorted(manager.keys()), ['beaker:ns:a', 'beaker:ns:b'])
+        index_key = manager._format_index_key('')
+        self.assertEqual(sorted(FakeRingo.entries[('default', index_key)]), ['a', 'b', 'c'])
+
+        # Rewrites do not grow the index, reinsertions after a delete do.
+        manager.set_value('c', 2)
+        self.assertEqual(len(FakeRingo.entries[('default', index_key)]), 4)
+        self.assertEqual(sorted(manager.keys()), ['beaker:ns:a', 'beaker:ns:b', 'beaker:ns:c'])
+
+    def test_generation_is_looked_up_once(self):
+        manager = self.manager(key_index=True)
+        manager.set_value('a', 1)
+        manager.set_value('b', 1)
+        generation_key = manager._format_generation_key()
+        lookups = [keys for method, keys in manager.db_conn.calls if method == 'get_many']
+        self.assertEqual([generation_key in keys for keys in lookups], [True, False])
+
+    def test_do_remove_starts_a_new_index(self):
+        manager = self.manager(key_index=True)
+        manager.set_many({'a': 1, 'b': 2})
+        manager.do_remove()
+        self.assertEqual(manager.get_many(['a', 'b']), {})
+        self.assertEqual(manager.keys(), [])
+
+        other = self.manager(key_index=True)
+        other.set_value('c', 3)
+        self.assertEqual(manager.keys(), ['beaker:ns:c'])
+        new_index = manager._format_index_key(manager.index_generation)
+        self.assertEqual(FakeRingo.entries[('default', new_index)], ['c'])
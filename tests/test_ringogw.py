@@ -0,0 +1,123 @@
+import unittest
+
+try:
+    from beaker_extensions.ringogw import DecodeJson, DecodeMulti, ReplyException, Ringo
+except ImportError:
+    # ringogw only runs on Python 2, with cjson and pycurl.
+    DecodeMulti = None
+
+
+STREAM = '5 ok hello3 ok abc0 ok 11 ok hello world'
+ENTRIES = ['hello', 'abc', '', 'hello world']
+
+
+def feed(decoder, data, size):
+    for i in range(0, len(data), size):
+        decoder.write(data[i:i + size])
+    return decoder.output()
+
+
+@unittest.skipIf(DecodeMulti is None, "ringogw requires Python 2")
+class DecodeMultiTest(unittest.TestCase):
+
+    def test_chunked_input(self):
+        for size in range(1, len(STREAM) + 1):
+            self.assertEqual(feed(DecodeMulti(), STREAM, size), ('ok', ENTRIES))
+
+    def test_failed_entry(self):
+        self.assertEqual(feed(DecodeMulti(), '2 ok ab2 fail cd', 3), ('fail', ['ab', 'cd']))
+
+    def test_callback(self):
+        seen = []
+        decoder = DecodeMulti(lambda entry, out: seen.append(entry.upper()))
+        self.assertEqual(feed(decoder, STREAM, 4), ('ok', []))
+        self.assertEqual(seen, [entry.upper() for entry in ENTRIES])
+
+    def test_compaction(self):
+        decoder = DecodeMulti()
+        decoder.compact_size = 8
+        self.assertEqual(feed(decoder, STREAM * 10, 5), ('ok', ENTRIES * 10))
+        self.assertTrue(len(decoder.buf) < len(STREAM))
+
+    def test_trailing_bytes(self):
+        decoder = DecodeMulti()
+        decoder.write('5 ok hello3 ok a')
+        self.assertRaises(ReplyException, decoder.output)
+
+
+class FakeCurl(object):
+    """pycurl.Curl stand-in answering with responses[url]."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.closed = False
+
+    def __getattr__(self, name):
+        # Option and info constants (URL, HTTP_CODE, ...)
+        if name.isupper():
+            return name
+        raise AttributeError(name)
+
+    def setopt(self, option, value):
+        if option == 'URL':
+            self.url = value
+        elif option == 'WRITEFUNCTION':
+            self.write = value
+
+    def getinfo(self, info):
+        return self.responses[self.url][0]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMulti(object):
+    """pycurl.CurlMulti stand-in completing every request at once."""
+
+    def __init__(self):
+        self.handles = []
+
+    def add_handle(self, curl):
+        self.handles.append(curl)
+
+    def remove_handle(self, curl):
+        self.handles.remove(curl)
+
+    def perform(self):
+        return None, len(self.handles)
+
+    def info_read(self):
+        for curl in self.handles:
+            curl.write(curl.responses[curl.url][1])
+        return 0, list(self.handles), []
+
+    def select(self, timeout):
+        pass
+
+
+@unittest.skipIf(DecodeMulti is None, "ringogw requires Python 2")
+class RequestManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.responses = {}
+        self.ringo = Ringo('ringo:15000', keep_alive=False, max_connections=2)
+        self.ringo.multi = FakeMulti()
+        self.ringo.handles.extend(FakeCurl(self.responses) for i in range(4))
+
+    def respond(self, key, code, body):
+        self.responses['http://ringo:15000/mon/data/d/%s?single' % key] = (code, body)
+
+    def test_error_replies_are_not_decoded(self):
+        self.respond('a', 200, '["ok"]')
+        self.respond('b', 503, '<html>Service Unavailable</html>')
+        requests = [('/mon/data/d/%s?single' % key, None, DecodeJson) for key in 'ab']
+        self.assertEqual(self.ringo.request_many(requests), [(200, ['ok']), (503, None)])
+
+    def test_failed_batches_leave_no_handles_attached(self):
+        self.respond('a', 200, 'not json')
+        self.respond('b', 200, 'not json')
+        requests = [('/mon/data/d/%s?single' % key, None, DecodeJson) for key in 'ab']
+        self.assertRaises(Exception, self.ringo.request_many, requests)
+        self.assertEqual(self.ringo.multi.handles, [])
+        self.respond('c', 200, 'c')
+        self.assertEqual(self.ringo.get_many('d', ['c']), {'c': 'c'})
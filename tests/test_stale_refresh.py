@@ -0,0 +1,86 @@
+import time
+import unittest
+
+try:
+    from beaker_extensions import nosql
+    from beaker_extensions.redis_ import RedisManager
+except ImportError:
+    RedisManager = None
+
+from fakes import use_fake_redis
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class StaleTtlTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    def test_values_outlive_their_expiry(self):
+        manager = RedisManager('ns', url='h1:1', stale_ttl=50)
+        manager.set_value('a', (time.time(), 10, 'x'))
+        manager.set_value('b', 'no expiry')
+        self.assertEqual(manager.db_conn.ttl(manager._format_key('a')), 60)
+        self.assertEqual(manager.db_conn.ttl(manager._format_key('b')), -1)
+
+    def test_disabled_by_default(self):
+        manager = RedisManager('ns', url='h1:1')
+        manager.set_value('a', (time.time(), 10, 'x'))
+        self.assertEqual(manager.db_conn.ttl(manager._format_key('a')), 10)
+
+
+@unittest.skipIf(RedisManager is None, "requires beaker and the 'redis' library")
+class EarlyRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        original = nosql.random
+
+        def restore():
+            nosql.random = original
+        self.addCleanup(restore)
+
+    def draw(self, u):
+        class FixedRandom(object):
+            @staticmethod
+            def random():
+                return u
+        nosql.random = FixedRandom
+
+    def stored(self, manager, age, expiretime=100):
+        storedtime = time.time() - age
+        manager.set_value('a', (storedtime, expiretime, 'x'))
+        return storedtime
+
+    def test_fresh_values_are_left_alone(self):
+        manager = RedisManager('ns', url='h1:1', early_refresh_delta=5)
+        storedtime = self.stored(manager, age=10)
+        self.draw(0.99)  # a gap of 5 * -log(0.01), about 23 seconds
+        self.assertEqual(manager['a'], (storedtime, 100, 'x'))
+
+    def test_values_close_to_expiry_are_reported_expired(self):
+        manager = RedisManager('ns', url='h1:1', early_refresh_delta=5)
+        self.stored(manager, age=90)
+        self.draw(0.99)
+        storedtime, expiretime, payload = manager['a']
+        self.assertTrue(storedtime + expiretime <= time.time())
+        self.assertEqual((expiretime, payload), (100, 'x'))
+        # Unlucky draws leave the value fresh.
+        self.draw(0.0)
+        storedtime, expiretime, payload = manager['a']
+        self.assertTrue(storedtime + expiretime > time.time())
+
+    def test_beta_scales_the_gap(self):
+        manager = RedisManager('ns', url='h1:1', early_refresh_delta=5, early_refresh_beta=0.1)
+        self.stored(manager, age=90)
+        self.draw(0.99)
+        storedtime, expiretime, payload = manager['a']
+        self.assertTrue(storedtime + expiretime > time.time())
+
+    def test_values_without_expiry(self):
+        manager = RedisManager('ns', url='h1:1', early_refresh_delta=5)
+        storedtime = self.stored(manager, age=90, expiretime=None)
+        self.draw(0.99)
+        self.assertEqual(manager['a'], (storedtime, None, 'x'))
+        manager.set_value('b', 'plain')
+        self.assertEqual(manager['b'], 'plain')
@@ -0,0 +1,105 @@
+import time
+import unittest
+
+try:
+    from beaker_extensions import tyrant_
+except ImportError:
+    # pytyrant only runs on Python 2.
+    tyrant_ = None
+
+from fakes import FakeTyrant
+
+
+@unittest.skipIf(tyrant_ is None, "TokyoTyrantManager requires the 'pytyrant' library")
+class TyrantTestCase(unittest.TestCase):
+
+    def setUp(self):
+        FakeTyrant.tyrant_error = tyrant_.TyrantError
+
+    def manager(self, namespace='ns', **params):
+        manager = tyrant_.TokyoTyrantManager(namespace, url='h1:1', **params)
+        manager.db_conn = FakeTyrant()
+        return manager
+
+
+class ExpiryTest(TyrantTestCase):
+
+    def test_values_are_stored_as_is_by_default(self):
+        manager = self.manager()
+        manager.set_value('a', (time.time(), 10, 'x'))
+        stored = manager.db_conn.data[manager._format_key('a')]
+        self.assertEqual(stored, manager._dumps(manager['a']))
+
+    def test_deadlines_are_stored_with_values(self):
+        manager = self.manager(expiry='lua', stale_ttl=5)
+        value = (time.time(), 10, 'x')
+        manager.set_value('a', value)
+        manager.set_many({'b': 'no expiry'})
+        deadline, payload = manager.db_conn.data[manager._format_key('a')].split(':', 1)
+        self.assertTrue(time.time() + 14 <= int(deadline) <= time.time() + 16)
+        self.assertEqual(manager._loads(payload), value)
+        self.assertTrue(manager.db_conn.data[manager._format_key('b')].startswith('0:'))
+        self.assertEqual(manager['a'], value)
+        self.assertEqual(manager.get_many(['a', 'b']), {'a': value, 'b': 'no expiry'})
+
+    def test_expired_values_are_missing(self):
+        manager = self.manager(expiry='lua')
+        manager.set_value('a', 'x', expiretime=10)
+        key = manager._format_key('a')
+        manager.db_conn.data[key] = '%d:%s' % (time.time() - 1, manager._dumps('x'))
+        self.assertEqual(manager.get_many(['a']), {})
+        self.assertFalse('a' in manager)
+        self.assertRaises(KeyError, lambda: manager['a'])
+        self.assertFalse(key in manager.db_conn.data)
+
+    def test_values_stored_without_expiry_stay_readable(self):
+        manager = self.manager(expiry='lua')
+        manager.db_conn.data[manager._format_key('a')] = manager._dumps('legacy')
+        self.assertEqual(manager['a'], 'legacy')
+        self.assertEqual(manager.get_many(['a']), {'a': 'legacy'})
+
+    def test_sweep_expired(self):
+        manager = self.manager(expiry='lua', sweep_batch_size=3)
+        other = self.manager('other', expiry='lua')
+        other.db_conn = manager.db_conn
+        for i in range(10):
+            manager.set_value('key%d' % i, i, expiretime=10)
+        other.set_value('a', 1, expiretime=10)
+        for key, value in list(manager.db_conn.data.items()):
+            if key.endswith(('1', '4', '7', 'a')):
+                manager.db_conn.data[key] = '1:' + value.split(':', 1)[1]
+        self.assertEqual(manager.sweep_expired(), 3)
+        self.assertEqual(manager.db_conn.calls.count('sweep'), 4)
+        self.assertEqual(len(manager.get_many(['key%d' % i for i in range(10)])), 7)
+        self.assertTrue(other._format_key('a') in manager.db_conn.data)
+
+
+class KeysTest(TyrantTestCase):
+
+    def fill(self, manager, count):
+        other = self.manager('ns2')
+        other.db_conn = manager.db_conn
+        other.set_value('a', 1)
+        manager.set_many(dict(('key%02d' % i, i) for i in range(count)))
+        return sorted(manager._format_key('key%02d' % i) for i in range(count))
+
+    def test_keys_are_paged_through_lua(self):
+        manager = self.manager(expiry='lua', keys_batch_size=4)
+        expected = self.fill(manager, 10)
+        self.assertEqual(manager.keys(), expected)
+        self.assertEqual(manager.db_conn.calls.count('list_keys'), 3)
+        self.assertEqual(self.manager('empty', expiry='lua').keys(), [])
+
+    def test_keys_without_lua(self):
+        manager = self.manager()
+        expected = self.fill(manager, 10)
+        self.assertEqual(manager.keys(), expected)
+        self.assertEqual(manager.db_conn.calls.count('fwmkeys'), 1)
+
+    def test_do_remove_is_scoped_to_the_namespace(self):
+        manager = self.manager(remove_batch_size=4)
+        self.fill(manager, 10)
+        manager.do_remove()
+        self.assertEqual(manager.keys(), [])
+        self.assertEqual(list(manager.db_conn.data), ['beaker:ns2:a'])
+        self.assertEqual(manager.db_conn.calls.count('outlist'), 3)